@@ -0,0 +1,396 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import copy
+
+import fiona
+import pandas as pd
+
+from naming_subb import (FRAGMENT_ENGINES, INTERSECTION_ENGINES, OUTPUT_CRS, OUTPUT_WRITERS, PIPELINE_STAGES,
+                         SCORING_METHODS, PipelineInstrumentation, SubbasinBuilder, decode_categories, peak_rss_bytes)
+import synthetic_hydrography
+
+
+SMALL_SUBBASINS_PATH = "Small_subs_100km2_cut.geojson"
+MAX_INTERSECTIONS_CSV = "max_intersections_dict.csv"
+# Проєкція, з якої суббасейни перепроєктуються при записі (UTM 36N, як у робочих шарах)
+WORKING_CRS = "EPSG:32636"
+
+# Набір етапів на синтетичних даних: масштаби (кількість суббасейнів), файл результатів і поріг регресії
+SUITE_SCALES = (1000, 10000, 100000)
+SUITE_RESULTS = "benchmark_results.json"
+REGRESSION_THRESHOLD = 1.25
+# Різниці, менші за ці, вважаються шумом вимірювання
+REGRESSION_MIN_SECONDS = 0.05
+REGRESSION_MIN_BYTES = 16 * 1024 * 1024
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def same_mapping(left, right):
+    # Порівняння словників з урахуванням NaN/None у значеннях
+    if left.keys() != right.keys():
+        return False
+    return all(left[key] == right[key] or (pd.isna(left[key]) and pd.isna(right[key])) for key in left)
+
+
+def compare_intersection_engines(builder, buffer_size=25, sample=None):
+    builder.check_and_change_crs()
+    builder.geometry_buffer_riv1(buffer_size=buffer_size)
+    if sample is not None:
+        builder.riv1 = builder.riv1.iloc[:sample]
+
+    results = {}
+    timings = {}
+    for engine in INTERSECTION_ENGINES:
+        results[engine], timings[engine] = timed(builder.compute_max_intersections, engine=engine)
+
+    return {
+        'riv1_reaches': len(builder.riv1),
+        'rivers': len(builder.rivers),
+        'timings': timings,
+        'speedup': timings['loop'] / timings['strtree'] if timings['strtree'] else float('inf'),
+        'identical': same_mapping(results['strtree'], results['loop']),
+    }
+
+
+def compare_scoring_methods(builder, buffer_size=25, sample=None):
+    # Час і узгодженість вибору головної річки за кількістю частин перетину та за довжиною
+    builder.check_and_change_crs()
+    builder.geometry_buffer_riv1(buffer_size=buffer_size)
+    if sample is not None:
+        builder.riv1 = builder.riv1.iloc[:sample]
+
+    results = {}
+    timings = {}
+    for scoring in SCORING_METHODS:
+        results[scoring], timings[scoring] = timed(builder.compute_max_intersections_strtree, scoring=scoring)
+
+    count, length = results['count'], results['length']
+    agreement = pd.DataFrame({'Subbasin': list(count), 'count': list(count.values())})
+    agreement['length'] = agreement['Subbasin'].map(length)
+    same = (agreement['count'] == agreement['length']) | (agreement['count'].isna() & agreement['length'].isna())
+    return {
+        'subbasins': len(agreement),
+        'timings': timings,
+        'speedup': timings['count'] / timings['length'] if timings['length'] else float('inf'),
+        'agreement': float(same.mean()) if len(same) else 1.0,
+        'disagreements': agreement[~same].reset_index(drop=True),
+    }
+
+
+def prepare_for_fragmentation(builder, buffer_size=25, optimize_buffer=-300, simplify_tolerance=20):
+    # Етапи GeoDataManager.construct до фрагментації
+    builder.check_and_change_crs()
+    builder.initialize_and_set_column_types()
+    builder.geometry_buffer_riv1(buffer_size=buffer_size)
+    builder.analyze_river_intersections()
+    builder.update_subbasins_with_main_river()
+    builder.optimize_geometry(buffer_size=optimize_buffer, simplify_tolerance=simplify_tolerance)
+
+
+def compare_fragment_engines(builder):
+    prepared = builder.subbasins.copy()
+    fragments = {}
+    timings = {}
+    for engine in FRAGMENT_ENGINES:
+        builder.subbasins = prepared.copy()
+        _, timings[engine] = timed(builder.fragment_subbasins_by_unique_id, engine=engine)
+        fragments[engine] = builder.subbasins['Fragment']
+
+    linear, loop = fragments['linear'], fragments['loop']
+    agree = (linear == loop) | (linear.isna() & loop.isna())
+    return {
+        'subbasins': len(prepared),
+        'groups': len(builder.subbasin_dict),
+        'timings': timings,
+        'speedup': timings['loop'] / timings['linear'] if timings['linear'] else float('inf'),
+        'agreement': float(agree.mean()) if len(agree) else 1.0,
+        'changed_subbasins': prepared.loc[~agree.to_numpy(), 'Subbasin'].tolist(),
+    }
+
+
+# Порядкові реалізації атрибутних етапів до векторизації, еталон для регресійної перевірки
+def reference_update_subbasins_with_main_river(builder):
+    for idx, row in builder.subbasins.iterrows():
+        main_river_name = builder.determine_main_river(row['Subbasin'])
+        if main_river_name:
+            builder.subbasins.at[idx, 'MainRiver'] = main_river_name
+        else:
+            builder.subbasins.at[idx, 'MainRiver'] = pd.NA
+
+
+def reference_compare_and_update_river_names(builder):
+    for idx, row in builder.subbasins.iterrows():
+        main_river_name = row['MainRiver']
+        if pd.notna(main_river_name):
+            builder.subbasins.at[idx, 'Name_UA'] = builder.get_river_for_subbasin(main_river_name, add_prefix=True)
+        else:
+            builder.subbasins.at[idx, 'Name_UA'] = pd.NA
+
+
+def reference_add_hierarchy_columns(builder):
+    max_hierarchy_length = max(len(hierarchy) for hierarchy in builder.hierarchy.values())
+    for i in range(2, max_hierarchy_length + 1):
+        column_name = f'FlowTo{i}'
+        if column_name not in builder.subbasins.columns:
+            builder.subbasins[column_name] = pd.NA
+            builder.subbasins[column_name] = builder.subbasins[column_name].astype('object')
+
+    for idx, row in builder.subbasins.iterrows():
+        key = (row['MainRiver'], row['FlowTo'])
+        if key in builder.hierarchy:
+            print(builder.hierarchy)
+            for i, river in enumerate(builder.hierarchy[key], start=2):
+                print(i, river)
+                builder.subbasins.at[idx, f'FlowTo{i}'] = river
+
+
+def sample_hierarchy(main_river_names, flow_to='None', max_depth=4):
+    # Детермінована ієрархія різної глибини для назв із max_intersections_dict
+    names = sorted({name for name in main_river_names if isinstance(name, str)})
+    return {(name, flow_to): names[position + 1:position + 1 + position % max_depth]
+            for position, name in enumerate(names)}
+
+
+def same_frame(left, right):
+    if list(left.columns) != list(right.columns):
+        return False
+    for column in left.columns:
+        if column == left.geometry.name:
+            continue
+        left_values = left[column].astype(object)
+        right_values = right[column].astype(object)
+        both_missing = left_values.isna() & right_values.isna()
+        if not ((left_values == right_values) | both_missing).all():
+            return False
+    return True
+
+
+def compare_attribute_stages(subbasins_path=SMALL_SUBBASINS_PATH, intersections_csv=MAX_INTERSECTIONS_CSV):
+    # Регресійна перевірка і пропускна здатність векторизованих атрибутних етапів
+    builder = SubbasinBuilder(subbasins_path=subbasins_path, cache_dir=None)
+    builder.initialize_and_set_column_types()
+    intersections = pd.read_csv(intersections_csv)
+    builder.max_intersections_dict = dict(zip(intersections['Subbasin'], intersections['MainRiver']))
+    builder.hierarchy = sample_hierarchy(builder.max_intersections_dict.values())
+
+    stages = [
+        ('update_subbasins_with_main_river', reference_update_subbasins_with_main_river),
+        ('compare_and_update_river_names', reference_compare_and_update_river_names),
+        ('add_hierarchy_columns', reference_add_hierarchy_columns),
+    ]
+    reference_builder = copy.copy(builder)
+    # Порядкові еталони записують рядки по клітинках, тому працюють з декодованими колонками
+    reference_builder.subbasins = decode_categories(builder.subbasins)
+    report = {'subbasins': len(builder.subbasins)}
+    for name, reference in stages:
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, reference_seconds = timed(reference, reference_builder)
+        _, vectorized_seconds = timed(getattr(builder, name))
+        report[name] = {
+            'reference_s': reference_seconds,
+            'vectorized_s': vectorized_seconds,
+            'rows_per_s': len(builder.subbasins) / vectorized_seconds if vectorized_seconds else float('inf'),
+            'identical': same_frame(reference_builder.subbasins, builder.subbasins),
+        }
+    return report
+
+
+def write_legacy_geojson(subbasins, path):
+    # Запис до потокових записувачів: перепроєкція всього шару і один виклик fiona
+    fiona.drvsupport.supported_drivers['GeoJSON'] = 'rw'
+    subbasins.to_crs(OUTPUT_CRS).to_file(path, driver='GeoJSON', engine='fiona')
+
+
+def compare_output_formats(subbasins_path=SMALL_SUBBASINS_PATH, working_crs=WORKING_CRS):
+    # Час запису і розмір файлу для кожного формату на шарі суббасейнів у стані перед збереженням
+    builder = SubbasinBuilder(subbasins_path=subbasins_path, cache_dir=None)
+    builder.initialize_and_set_column_types()
+    builder.subbasins = builder.subbasins.to_crs(working_crs)
+
+    report = {'subbasins': len(builder.subbasins)}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'legacy.geojson')
+        _, seconds = timed(write_legacy_geojson, builder.subbasins, path)
+        report['legacy geojson'] = {'write_s': seconds, 'size_bytes': os.path.getsize(path)}
+        for output_format, writer in OUTPUT_WRITERS.items():
+            path = os.path.join(directory, output_format + writer.extension)
+            _, seconds = timed(builder.save_subbasains_new, output_format, path=path)
+            report[output_format] = {'write_s': seconds, 'size_bytes': os.path.getsize(path)}
+    return report
+
+
+def suite_stages(output_path):
+    # Етапи конвеєра разом із закоментованими в PIPELINE_STAGES етапами ієрархії; читання шарів окремо від обробки
+    stages = [('read_layers', read_layers), ('build_river_hierarchy', build_hierarchy)]
+    for stage_name, stage_kwargs in PIPELINE_STAGES:
+        if stage_name == 'save_subbasains_new':
+            stage_kwargs = dict(stage_kwargs, path=output_path)
+        stages.append((stage_name, lambda builder, name=stage_name, kwargs=stage_kwargs: getattr(builder, name)(**kwargs)))
+        if stage_name == 'compare_and_update_river_names':
+            stages.append(('add_hierarchy_columns', lambda builder: builder.add_hierarchy_columns()))
+    return stages
+
+
+def read_layers(builder):
+    for layer in (builder.subbasins, builder.rivers, builder.rivers_new, builder.riv1):
+        layer.sindex
+
+
+def build_hierarchy(builder):
+    builder.hierarchy = builder.build_river_hierarchy()
+
+
+def run_scale(paths, output_path):
+    # Виконується в окремому процесі, щоб пікова пам'ять не накопичувалась між масштабами
+    builder = SubbasinBuilder(**paths, cache_dir=None)
+    instrumentation = PipelineInstrumentation(count_vertices=False)
+    for stage_name, stage in suite_stages(output_path):
+        with instrumentation.stage(stage_name, builder):
+            stage(builder)
+    report = instrumentation.report()
+    return {
+        'total_wall_s': report['total_wall_s'],
+        'peak_rss_bytes': peak_rss_bytes(),
+        'stages': {record['stage']: {key: record[key] for key in ('wall_s', 'cpu_s', 'rss_bytes', 'rss_delta_bytes',
+                                                                   'peak_rss_bytes', 'peak_rss_increase_bytes')}
+                   for record in report['stages']},
+    }
+
+
+def run_suite(scales=SUITE_SCALES, data_dir=None, seed=0):
+    # Дані кожного масштабу генеруються один раз; з data_dir повторно використовуються між запусками
+    results = {
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'seed': seed,
+        'scales': {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        data_dir = data_dir or directory
+        for subbasins in scales:
+            scale_dir = os.path.join(data_dir, f"synthetic_{subbasins}_{seed}")
+            paths, generate_seconds = timed(synthetic_layers, scale_dir, subbasins, seed)
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                scale = executor.submit(run_scale, paths, os.path.join(directory, f"output_{subbasins}.geojson")).result()
+            results['scales'][str(subbasins)] = dict(subbasins=subbasins, generate_s=generate_seconds, **scale)
+    return results
+
+
+def synthetic_layers(directory, subbasins, seed):
+    paths = synthetic_hydrography.layer_paths(directory)
+    if all(os.path.exists(path) for path in paths.values()):
+        return paths
+    return synthetic_hydrography.write_layers(directory, subbasins, seed=seed)
+
+
+def find_regressions(results, baseline, threshold=REGRESSION_THRESHOLD):
+    # Етапи, що сповільнились, і масштаби, де зросла пікова пам'ять, відносно попередніх результатів
+    regressions = []
+    for scale, current in results['scales'].items():
+        previous = baseline['scales'].get(scale)
+        if previous is None:
+            continue
+        for stage_name, record in current['stages'].items():
+            previous_record = previous['stages'].get(stage_name)
+            if previous_record is None:
+                continue
+            wall, previous_wall = record['wall_s'], previous_record['wall_s']
+            if wall > previous_wall * threshold and wall - previous_wall > REGRESSION_MIN_SECONDS:
+                regressions.append({'scale': scale, 'stage': stage_name, 'metric': 'wall_s',
+                                    'baseline': previous_wall, 'current': wall})
+        peak, previous_peak = current.get('peak_rss_bytes'), previous.get('peak_rss_bytes')
+        if peak is not None and previous_peak is not None:
+            if peak > previous_peak * threshold and peak - previous_peak > REGRESSION_MIN_BYTES:
+                regressions.append({'scale': scale, 'stage': None, 'metric': 'peak_rss_bytes',
+                                    'baseline': previous_peak, 'current': peak})
+    return regressions
+
+
+def print_suite(results):
+    for scale, report in results['scales'].items():
+        print(f"{scale} subbasins (generated in {report['generate_s']:.1f} s, "
+              f"peak {report['peak_rss_bytes'] / 2 ** 20:.0f} MiB)")
+        for stage_name, record in report['stages'].items():
+            print(f"  {stage_name:>34}: {record['wall_s']:8.3f} s")
+
+
+def print_report(title, report):
+    print(title)
+    for key, value in report.items():
+        if key == 'timings':
+            for engine, seconds in value.items():
+                print(f"  {engine:>8}: {seconds:.3f} s")
+        elif key == 'disagreements':
+            print(f"  {key}: {len(value)}")
+            if len(value):
+                print(value.head(20).to_string(index=False))
+        elif key != 'changed_subbasins':
+            print(f"  {key}: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Порівняння продуктивності етапів SubbasinBuilder")
+    parser.add_argument('stage', choices=['intersections', 'scoring', 'fragments', 'attributes', 'output', 'suite'])
+    parser.add_argument('--sample', type=int, default=None,
+                        help="Кількість riv1 для порівняння (цикл на повному шарі триває години)")
+    parser.add_argument('--buffer-size', type=float, default=25)
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SUITE_SCALES),
+                        help="Кількість синтетичних суббасейнів для suite")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=None, help="Каталог для повторного використання синтетичних даних")
+    parser.add_argument('--results', default=SUITE_RESULTS)
+    parser.add_argument('--baseline', default=None, help="Попередні результати suite для пошуку регресій")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.stage == 'suite':
+        results = run_suite(scales=args.scales, data_dir=args.data_dir, seed=args.seed)
+        with open(args.results, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        print_suite(results)
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as file:
+                regressions = find_regressions(results, json.load(file), threshold=args.threshold)
+            for regression in regressions:
+                print(f"REGRESSION {regression['scale']} {regression['stage'] or ''} {regression['metric']}: "
+                      f"{regression['baseline']:.3f} -> {regression['current']:.3f}")
+            if regressions:
+                sys.exit(1)
+        return
+
+    if args.stage == 'attributes':
+        print_report("attribute stages", compare_attribute_stages())
+        return
+    if args.stage == 'output':
+        print_report("save_subbasains_new", compare_output_formats())
+        return
+
+    builder = SubbasinBuilder()
+    if args.stage == 'intersections':
+        report = compare_intersection_engines(builder, buffer_size=args.buffer_size, sample=args.sample)
+        print_report("analyze_river_intersections", report)
+    elif args.stage == 'scoring':
+        report = compare_scoring_methods(builder, buffer_size=args.buffer_size, sample=args.sample)
+        print_report("main river scoring: count vs length", report)
+    else:
+        prepare_for_fragmentation(builder, buffer_size=args.buffer_size)
+        report = compare_fragment_engines(builder)
+        print_report("fragment_subbasins_by_unique_id", report)
+
+
+if __name__ == '__main__':
+    main()
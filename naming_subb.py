@@ -1,21 +1,895 @@
 import shapely
-from shapely import MultiPoint, LineString, GeometryCollection
+from shapely import LineString, GeometryCollection
 from shapely.geometry import Point, MultiLineString
 from abc import ABC, abstractmethod
-import geopandas as gpd
-import fiona
-from shapely.ops import unary_union
+import argparse
+import copy
+import importlib
+import importlib.util
 import os
-import pandas as pd
+import tempfile
+import re
+import sys
+import threading
+import time
+import hashlib
+import json
+import logging
+import cProfile
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field, replace
+import numpy as np
 import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
+
+class LazyModule:
+    # Модуль імпортується при першому зверненні до атрибута і підміняє себе в глобальних іменах,
+    # тож імпорт naming_subb не завантажує pandas/geopandas/fiona/pyarrow
+
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attribute)
+
+
+pd = LazyModule('pandas', 'pd')
+gpd = LazyModule('geopandas', 'gpd')
+fiona = LazyModule('fiona', 'fiona')
+pa = LazyModule('pyarrow', 'pa')
+pq = LazyModule('pyarrow.parquet', 'pq')
+pyproj = LazyModule('pyproj', 'pyproj')
+pyogrio = LazyModule('pyogrio', 'pyogrio') if importlib.util.find_spec('pyogrio') else None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
 
 
 RIVERS_PATH = "C:\\Users\\user\\Documents\\SWAT_subbasyn\\river\\rivers_UA_RU_MD_BY_projected.shp"
 RIVERS_NEW_PATH = "C:\\Users\\user\\Documents\\SWAT_subbasyn\\SWB__Rivers_UKRAINE_23_12_2019\\SWB_R_total.shp"
 SUBBASINS_PATH = "C:\\Users\\user\\PycharmProjects\\topo_SWAT_UKR\\Small_subs_100km2_cut.geojson"
 RIV1_PATH = "C:\\Users\\user\\Documents\\SWAT_subbasyn\\riv1\\riv1.shp"
-FILE_INPUT =  f"C:\\Users\\user\\Documents\\SWAT_subbasyn\\subbasins_update_name_{datetime.datetime.now().strftime('%H_%M_%S')}.geojson"
+OUTPUT_DIR = "C:\\Users\\user\\Documents\\SWAT_subbasyn"
+OUTPUT_NAME = "subbasins_update_name"
+
+# Колонки, які реально потрібні конвеєру з кожного шару
+RIVERS_COLUMNS = ['name_ua']
+RIVERS_NEW_COLUMNS = ['NAME_UKR', 'FLOW_TO']
+RIV1_COLUMNS = ['Subbasin']
+# Запас навколо охоплення суббасейнів при читанні шарів, м
+LAYER_BBOX_PADDING = 1000
+_METERS_PER_DEGREE = 111320
+
+INTERSECTION_ENGINES = ('strtree', 'loop')
+# count - кількість частин перетину з буфером riv1; length - довжина річки всередині буфера
+SCORING_METHODS = ('count', 'length')
+# Кількість просторових частин на один процес у паралельному режимі
+PARTITIONS_PER_WORKER = 4
+# GeoSeries.buffer за замовчуванням використовує resolution=16
+_BUFFER_QUAD_SEGS = 16
+FRAGMENT_ENGINES = ('linear', 'loop')
+# independent - buffer/simplify кожного полігону окремо; topology - спільні межі спрощуються один раз
+OPTIMIZE_MODES = ('independent', 'topology')
+
+# Позаядерний режим: розмір плитки riv1 (м) і кількість назв в одному SQL-фільтрі шару річок
+TILE_SIZE = 50000
+RIVER_NAME_BATCH = 500
+
+# Кеш результатів analyze_river_intersections
+INTERSECTIONS_CACHE_DIR = "intersections_cache"
+INTERSECTIONS_CACHE_MAX_ENTRIES = 16
+INTERSECTIONS_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Вихідний файл: CRS, розмір частини для потокового запису, точність координат GeoJSON
+# (None - повна, як раніше; округлення вмикається явно, наприклад precision=6 - ~0.1 м)
+OUTPUT_CRS = "EPSG:4326"
+OUTPUT_CHUNK_SIZE = 2000
+OUTPUT_COORDINATE_PRECISION = None
+
+# Стан останнього запуску для інкрементного режиму
+RUN_STATE_DIR = "run_state"
+RUN_STATE_VERSION = 1
+RUN_STATE_TABLES = ('riv1', 'rivers', 'river_pairs')
+# Назви, до яких не додається префікс "р. "
+CANAL_INDICATORS = ["канал", "магістральний", "рч-2", "чорноморський", "роздольненська"]
+NO_PREFIX_INDICATORS = ["рук.", "гирло", "лиман", "рукав", "водосховище"]
+_NO_PREFIX_PATTERN = re.compile('|'.join(re.escape(indicator)
+                                         for indicator in CANAL_INDICATORS + NO_PREFIX_INDICATORS))
+RIVER_PREFIX = "р. "
+
+# Водойми, у яких закінчується ланцюжок стоку
+SEAS = ("Чорне море", "Азовське море")
+
+# Збільшувати при зміні алгоритму вибору головної річки, щоб інвалідувати кеш
+INTERSECTIONS_ALGORITHM_VERSION = 1
+# Супутні файли шейпфайлу, зміна яких теж має інвалідувати кеш
+_SHAPEFILE_SIDECARS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+# Ідентифікатори типів геометрії shapely, які рахуються як один перетин
+_SINGLE_PART_TYPE_IDS = (0, 1, 2)  # Point, LineString, LinearRing
+_MULTI_LINESTRING_TYPE_ID = 5
+_GEOMETRY_COLLECTION_TYPE_ID = 7
+
+
+def count_intersection_parts(geometries):
+    # Векторизований аналог SubbasinBuilder.count_intersections
+    geometries = np.asarray(geometries, dtype=object)
+    counts = np.zeros(len(geometries), dtype=np.int64)
+    if len(geometries) == 0:
+        return counts
+
+    type_ids = shapely.get_type_id(geometries)
+    not_empty = ~shapely.is_empty(geometries)
+
+    counts[np.isin(type_ids, _SINGLE_PART_TYPE_IDS) & not_empty] = 1
+
+    multi_lines = (type_ids == _MULTI_LINESTRING_TYPE_ID) & not_empty
+    counts[multi_lines] = shapely.get_num_geometries(geometries[multi_lines])
+
+    collections = np.flatnonzero((type_ids == _GEOMETRY_COLLECTION_TYPE_ID) & not_empty)
+    if len(collections):
+        parts, part_index = shapely.get_parts(geometries[collections], return_index=True)
+        part_counts = count_intersection_parts(parts)
+        counts[collections] = np.bincount(part_index, weights=part_counts, minlength=len(collections))
+
+    return counts
+
+
+def select_main_rivers(riv1_geometries, river_geometries, river_names, river_tree=None, scoring='count'):
+    # Для кожного riv1 шукає річку з найбільшою кількістю перетинів (або довжиною всередині буфера).
+    # Повертає позиції riv1 (за зростанням) та назви (або коди назв) відповідних головних річок.
+    if scoring not in SCORING_METHODS:
+        raise ValueError(f"Unknown scoring method: {scoring!r}, expected one of {SCORING_METHODS}")
+    riv1_geometries = np.asarray(riv1_geometries, dtype=object)
+    river_geometries = np.asarray(river_geometries, dtype=object)
+    river_names = np.asarray(river_names)
+    if river_tree is None:
+        river_tree = shapely.STRtree(river_geometries)
+
+    riv1_idx, river_idx = river_tree.query(riv1_geometries, predicate='intersects')
+    if len(riv1_idx) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=river_names.dtype)
+
+    # Порядок пар як у вкладеному циклі: riv1, потім річки за порядком у шарі
+    order = np.lexsort((river_idx, riv1_idx))
+    riv1_idx = riv1_idx[order]
+    river_idx = river_idx[order]
+
+    intersections = shapely.intersection(riv1_geometries[riv1_idx], river_geometries[river_idx])
+    pairs = pd.DataFrame({
+        'riv1': riv1_idx,
+        'river_name': river_names[river_idx],
+        'score': count_intersection_parts(intersections) if scoring == 'count' else shapely.length(intersections),
+    })
+
+    totals = (pairs.groupby(['riv1', 'river_name'], sort=False, dropna=False)['score']
+              .sum()
+              .reset_index())
+    # idxmax повертає перший максимум, як і max() по словнику в циклі
+    best = totals.loc[totals.groupby('riv1', sort=False)['score'].idxmax()]
+    return best['riv1'].to_numpy(), best['river_name'].to_numpy()
+
+
+def apply_geometry_operations(wkb, operations):
+    # Виконується в робочому процесі: WKB -> buffer/simplify -> WKB
+    geometries = shapely.from_wkb(wkb)
+    for operation, value in operations:
+        if operation == 'buffer':
+            geometries = shapely.buffer(geometries, value, quad_segs=_BUFFER_QUAD_SEGS)
+        elif operation == 'simplify':
+            geometries = shapely.simplify(geometries, value, preserve_topology=True)
+        else:
+            raise ValueError(f"Unknown geometry operation: {operation!r}")
+    return shapely.to_wkb(geometries)
+
+
+def select_main_rivers_partition(riv1_wkb, riv1_positions, river_wkb, river_positions, river_names, scoring='count'):
+    # Виконується в робочому процесі для однієї просторової частини riv1
+    local_riv1, main_rivers = select_main_rivers(shapely.from_wkb(riv1_wkb), shapely.from_wkb(river_wkb), river_names,
+                                                 scoring=scoring)
+    return riv1_positions[local_riv1], main_rivers
+
+
+def partition_by_grid(geometries, partitions):
+    # Розбиття на частини сіткою за квантилями центрів охоплюючих прямокутників
+    geometries = np.asarray(geometries, dtype=object)
+    if len(geometries) == 0:
+        return []
+    bounds = shapely.bounds(geometries)
+    centers_x = np.nan_to_num((bounds[:, 0] + bounds[:, 2]) / 2)
+    centers_y = np.nan_to_num((bounds[:, 1] + bounds[:, 3]) / 2)
+    side = max(1, int(np.ceil(np.sqrt(partitions))))
+    quantiles = np.linspace(0, 1, side + 1)[1:-1]
+    columns = np.searchsorted(np.quantile(centers_x, quantiles), centers_x, side='right')
+    rows = np.searchsorted(np.quantile(centers_y, quantiles), centers_y, side='right')
+    cells = rows * side + columns
+    return [np.flatnonzero(cells == cell) for cell in np.unique(cells)]
+
+def read_layer(path, columns=None, bbox=None):
+    # Arrow-читання через pyogrio, якщо доступне; інакше fiona з відбором колонок після читання
+    if pyogrio is not None:
+        return gpd.read_file(path, columns=columns, bbox=bbox, engine='pyogrio', use_arrow=True)
+    layer = gpd.read_file(path, bbox=bbox, engine='fiona')
+    if columns is not None:
+        layer = layer[list(columns) + [layer.geometry.name]]
+    return layer
+
+
+def read_layer_crs(path):
+    # CRS шару з метаданих, без читання об'єктів
+    if pyogrio is not None:
+        crs = pyogrio.read_info(path)['crs']
+    else:
+        with fiona.open(path) as source:
+            crs = source.crs
+    return pyproj.CRS.from_user_input(crs) if crs else None
+
+def file_fingerprint(path, hash_contents=False):
+    # Відбиток файлу (і супутніх файлів шейпфайлу): розмір + mtime або хеш вмісту
+    stem, extension = os.path.splitext(path)
+    if extension.lower() == '.shp':
+        paths = [stem + sidecar for sidecar in _SHAPEFILE_SIDECARS if os.path.exists(stem + sidecar)]
+    else:
+        paths = [path]
+
+    fingerprint = []
+    for file_path in paths:
+        stat = os.stat(file_path)
+        if hash_contents:
+            digest = hashlib.sha256()
+            with open(file_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            fingerprint.append([os.path.basename(file_path), stat.st_size, digest.hexdigest()])
+        else:
+            fingerprint.append([os.path.basename(file_path), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def write_main_rivers(path, max_intersections_dict):
+    # Компактне збереження max_intersections_dict (Subbasin -> MainRiver) у Parquet
+    df = pd.DataFrame({
+        'Subbasin': list(max_intersections_dict.keys()),
+        'MainRiver': pd.Series(list(max_intersections_dict.values()), dtype=object),
+    })
+    # Запис через тимчасовий файл: паралельні запуски (процеси і потоки) не бачать частково записаний файл
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def read_main_rivers(path):
+    df = pd.read_parquet(path)
+    return dict(zip(df['Subbasin'].to_numpy(), df['MainRiver'].to_numpy(dtype=object)))
+
+def feature_hashes(geometries, *attributes):
+    # 64-бітний хеш кожного об'єкта за WKB геометрії та значеннями атрибутів
+    columns = {'wkb': shapely.to_wkb(np.asarray(geometries, dtype=object))}
+    for position, values in enumerate(attributes):
+        columns[f'attribute_{position}'] = np.asarray(values, dtype=object)
+    return pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+
+
+def changed_hashes(previous, current):
+    # Хеші, кількість яких відрізняється між запусками: додані, видалені та змінені об'єкти
+    counts = pd.concat([pd.Series(previous).value_counts(), pd.Series(current).value_counts()], axis=1).fillna(0)
+    return counts.index[counts.iloc[:, 0] != counts.iloc[:, 1]].to_numpy()
+
+
+def run_state_stages(stages):
+    # Етапи і аргументи, що визначають результат; параметри запису (шлях, каталог, формат виходу)
+    # не входять, тож їх зміна не скасовує інкрементний режим
+    return json.loads(json.dumps([(stage_name, {} if stage_name == 'save_subbasains_new' else stage_kwargs)
+                                  for stage_name, stage_kwargs in stages]))
+
+
+class IntersectionCache:
+    # Контентно-адресований кеш max_intersections_dict у форматі Parquet з LRU-витісненням
+
+    def __init__(self, cache_dir=INTERSECTIONS_CACHE_DIR, max_entries=INTERSECTIONS_CACHE_MAX_ENTRIES,
+                 max_bytes=INTERSECTIONS_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(**inputs):
+        payload = json.dumps(inputs, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            max_intersections_dict = read_main_rivers(path)
+            # Оновлення часу доступу для LRU
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return max_intersections_dict
+
+    def put(self, key, max_intersections_dict):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_main_rivers(self.entry_path(key), max_intersections_dict)
+        self.evict()
+
+    def evict(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.parquet'):
+                path = os.path.join(self.cache_dir, name)
+                # Запис міг бути витіснений паралельним запуском
+                with suppress(FileNotFoundError):
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        # Найсвіжіші записи залишаються, найстаріші видаляються
+        entries.sort(reverse=True)
+        total_bytes = 0
+        for position, (_, size, path) in enumerate(entries):
+            total_bytes += size
+            if position >= self.max_entries or total_bytes > self.max_bytes:
+                with suppress(FileNotFoundError):
+                    os.remove(path)
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.parquet'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+def merge_river_line(geometries):
+    # Об'єднання всіх частин річки в одну лінію з напрямком оцифрування (витік -> гирло).
+    # Якщо частини не зливаються в одну лінію, береться компонента з витоком першого об'єкта.
+    parts = shapely.get_parts(np.asarray(geometries, dtype=object))
+    parts = parts[~shapely.is_empty(parts)]
+    if len(parts) == 0:
+        return None
+    source = shapely.get_point(parts[0], 0)
+    merged = shapely.line_merge(shapely.multilinestrings(parts), directed=True)
+    components = shapely.get_parts(merged)
+    if len(components) == 1:
+        return components[0]
+    return components[np.argmin(shapely.distance(components, source))]
+
+
+def union_by_group(geometries, groups):
+    # union_all для кожної групи одним покомпонентним викликом по матриці "група x елементи"
+    order = np.argsort(groups, kind='stable')
+    owners, starts, counts = np.unique(groups[order], return_index=True, return_counts=True)
+    matrix = np.full((len(owners), counts.max() if len(counts) else 0), None, dtype=object)
+    matrix[np.repeat(np.arange(len(owners)), counts), np.arange(len(order)) - np.repeat(starts, counts)] = \
+        geometries[order]
+    return owners, shapely.union_all(matrix, axis=1)
+
+
+def resolve_overlaps(geometries, priority=None):
+    # Усуває перекриття полігонів: спільна ділянка залишається за полігоном з меншим
+    # значенням priority (за замовчуванням - з меншою позицією). Усі різниці рахуються
+    # від вихідних геометрій одночасно, тому індекс не перебудовується після кожної зміни.
+    geometries = np.array(geometries, dtype=object)
+    count = len(geometries)
+    invalid = ~shapely.is_valid(geometries) & ~shapely.is_missing(geometries)
+    geometries[invalid] = shapely.buffer(geometries[invalid], 0)
+
+    if priority is None:
+        priority = np.arange(count)
+    rank = np.empty(count, dtype=np.int64)
+    rank[np.argsort(np.asarray(priority), kind='stable')] = np.arange(count)
+
+    # Усі пари-кандидати одним запитом до STRtree
+    losers, winners = shapely.STRtree(geometries).query(geometries, predicate='intersects')
+    keep = rank[losers] > rank[winners]
+    losers, winners = losers[keep], winners[keep]
+    # Лише перетин внутрішніх частин, спільні межі сусідів не є перекриттям
+    overlapping = shapely.relate_pattern(geometries[losers], geometries[winners], 'T********')
+    losers, winners = losers[overlapping], winners[overlapping]
+
+    overlaps_with = [[] for _ in range(count)]
+    if len(losers):
+        order = np.lexsort((rank[winners], losers))
+        losers, winners = losers[order], winners[order]
+        targets, covering = union_by_group(geometries[winners], losers)
+        resolved = shapely.difference(geometries[targets], covering)
+
+        original = geometries.copy()
+        geometries[targets] = resolved
+        for loser, winner in zip(losers, winners):
+            overlaps_with[loser].append(winner)
+        removed_area = shapely.area(original) - shapely.area(geometries)
+    else:
+        removed_area = np.zeros(count)
+
+    changed = invalid | np.array([bool(partners) for partners in overlaps_with], dtype=bool)
+    report = pd.DataFrame({
+        'position': np.flatnonzero(changed),
+        'fixed_invalid': invalid[changed],
+        'overlaps_with': [overlaps_with[position] for position in np.flatnonzero(changed)],
+        'removed_area': removed_area[changed],
+    })
+    return geometries, report
+
+
+def simplify_shared_arcs(geometries, tolerance, simplify_arcs=None):
+    # Спрощення покриття полігонів зі збереженням топології: межі розбиваються на дуги між вузлами,
+    # де сходяться три й більше полігонів; кожна дуга спрощується один раз, і кожен полігон
+    # збирається зі своїх спрощених дуг, тож сусіди отримують однакову спільну межу.
+    # Виграш у кількості вершин є лише для покриття без перекриттів і щілин.
+    geometries = np.array(geometries, dtype=object)
+    present = np.flatnonzero(~shapely.is_missing(geometries) & ~shapely.is_empty(geometries))
+    if len(present) == 0:
+        return geometries
+    polygons = geometries[present]
+    invalid = ~shapely.is_valid(polygons)
+    polygons[invalid] = shapely.buffer(polygons[invalid], 0)
+    if simplify_arcs is None:
+        def simplify_arcs(arcs):
+            return shapely.simplify(arcs, tolerance, preserve_topology=True)
+
+    def simplify_independently(reason):
+        logger.info("Subbasins are not a clean coverage (%s), simplifying polygons independently", reason)
+        geometries[present] = shapely.simplify(polygons, tolerance, preserve_topology=True)
+        return geometries
+
+    # Вузлування покриття з перекриттями або розбіжними вершинами на спільних межах додає вузли
+    # в місцях перетину, і результат має більше вершин, ніж незалежне спрощення.
+    # coverage_is_valid (shapely >= 2.1) перевіряє це до дорогого вузлування
+    if hasattr(shapely, 'coverage_is_valid') and not shapely.coverage_is_valid(polygons):
+        return simplify_independently("overlapping or mismatched edges")
+    boundaries = shapely.boundary(polygons)
+    arcs = shapely.get_parts(shapely.line_merge(shapely.union_all(boundaries)))
+    polygon_vertices = shapely.get_num_coordinates(polygons)
+    if shapely.get_num_coordinates(arcs).sum() > polygon_vertices.sum():
+        return simplify_independently(f"{len(arcs)} arcs")
+    simplified = np.asarray(simplify_arcs(arcs), dtype=object)
+    logger.debug("Shared-arc simplification: %d arcs, %d polygon vertices, %d -> %d arc vertices", len(arcs),
+                 shapely.get_num_coordinates(polygons).sum(), shapely.get_num_coordinates(arcs).sum(),
+                 shapely.get_num_coordinates(simplified).sum())
+
+    # Власники дуги - полігони, на межі яких лежить її середина
+    xmin, ymin, xmax, ymax = shapely.total_bounds(polygons)
+    tolerance_on_boundary = 1e-9 * max(xmax - xmin, ymax - ymin, 1)
+    arc_idx, polygon_idx = shapely.STRtree(boundaries).query(
+        shapely.line_interpolate_point(arcs, 0.5, normalized=True), predicate='dwithin',
+        distance=tolerance_on_boundary)
+
+    # Незалежно спрощені дуги одного полігону можуть перетнутися, тому вони вузлуються перед збиранням
+    owners, rings = union_by_group(simplified[arc_idx], polygon_idx)
+    rebuilt = shapely.build_area(rings)
+
+    # Полігони, що зникли, зламалися або отримали більше вершин, ніж мали, спрощуються окремо
+    usable = np.zeros(len(polygons), dtype=bool)
+    usable[owners] = (~shapely.is_empty(rebuilt) & shapely.is_valid(rebuilt)
+                      & (shapely.get_num_coordinates(rebuilt) <= polygon_vertices[owners]))
+    resolved = polygons.copy()
+    resolved[owners] = rebuilt
+    resolved[~usable] = shapely.simplify(polygons[~usable], tolerance, preserve_topology=True)
+    geometries[present] = resolved
+    return geometries
+
+
+def normalize_apostrophes(river_name):
+    return river_name.replace("'", "’")
+
+
+class RiverNameTable:
+    # Інтернована таблиця назв річок: кожна назва зберігається один раз, а колонки, граф стоку й ієрархія
+    # тримають цілі коди. Код -1 - відсутня назва; назви декодуються лише на виході.
+    # Таблиця лише доповнюється, тож коди не змінюються; у пакетному режимі її спільно доповнюють кілька потоків.
+
+    def __init__(self):
+        self.names = []
+        self.codes = {}
+        self._lock = threading.Lock()
+        self._dtype = None
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(name)
+                if code is None:
+                    code = len(self.names)
+                    self.names.append(name)
+                    self.codes[name] = code
+        return code
+
+    def code(self, name):
+        # Код без додавання назви в таблицю; -1, якщо назви немає
+        return self.codes.get(name, -1)
+
+    @property
+    def dtype(self):
+        # Кеш перебудовується, коли таблиця виросла
+        dtype = self._dtype
+        if dtype is None or len(dtype.categories) != len(self.names):
+            dtype = self._dtype = pd.CategoricalDtype(pd.Index(self.names[:], dtype=object))
+        return dtype
+
+    def interned(self, dtype):
+        # Чи є dtype категоріями цієї таблиці (на будь-який момент її росту): тоді коди колонки - коди таблиці
+        if not isinstance(dtype, pd.CategoricalDtype) or len(dtype.categories) > len(self.names):
+            return False
+        categories = self.dtype.categories
+        return dtype.categories is categories or dtype.categories.equals(categories[:len(dtype.categories)])
+
+    def encode(self, values):
+        # Коди int32 для колонки, масиву або Categorical (категорії будь-якої таблиці); не рядки -> -1
+        if isinstance(values, pd.Series):
+            values = values.array
+        if isinstance(values, pd.Categorical):
+            inverse, uniques = values.codes, values.categories
+        else:
+            inverse, uniques = pd.factorize(np.asarray(values, dtype=object))
+        mapping = self.dtype.categories.get_indexer(uniques).astype(np.int32)
+        for position in np.flatnonzero(mapping < 0):
+            name = uniques[position]
+            mapping[position] = self.intern(name) if isinstance(name, str) else -1
+        codes = np.full(len(inverse), -1, dtype=np.int32)
+        present = inverse >= 0
+        codes[present] = mapping[inverse[present]]
+        return codes
+
+    def decode(self, codes):
+        lookup = self._lookup
+        if lookup is None or len(lookup) != len(self.names) + 1:
+            # Останній елемент - None для коду -1
+            names = self.names[:]
+            lookup = np.empty(len(names) + 1, dtype=object)
+            lookup[:-1] = names
+            self._lookup = lookup
+        return lookup[np.asarray(codes, dtype=np.int64)]
+
+    def categorical(self, values=None, codes=None, index=None):
+        if codes is None:
+            codes = self.encode(values)
+            if index is None and isinstance(values, pd.Series):
+                index = values.index
+        return pd.Series(pd.Categorical.from_codes(codes, dtype=self.dtype), index=index)
+
+
+def intern_layer_columns(table, layer, columns):
+    # Колонки назв -> Categorical з категоріями таблиці; вже інтерновані цією таблицею колонки і шар не копіюються
+    if layer is None:
+        return None
+    columns = [column for column in columns if not table.interned(layer[column].dtype)]
+    if not columns:
+        return layer
+    return layer.assign(**{column: table.categorical(layer[column]) for column in columns})
+
+
+def decode_categories(frame):
+    # Категоріальні колонки назв -> рядки для запису; відсутні значення стають None
+    columns = [column for column in frame.columns if isinstance(frame[column].dtype, pd.CategoricalDtype)]
+    if not columns:
+        return frame
+    return frame.assign(**{column: frame[column].astype(object).where(frame[column].notna(), None)
+                           for column in columns})
+
+
+class RiverHierarchy:
+    # Ієрархія "(річка, куди впадає) -> ланцюжок стоку" у форматі CSR: ланцюжок рядка i - це
+    # path_codes[offsets[i]:offsets[i + 1]], усі назви - коди RiverNameTable.
+    # Інтерфейс словника (get, [], in, values, items) декодує назви для сумісності.
+
+    def __init__(self, table, name_codes, flow_codes, offsets, path_codes):
+        self.table = table
+        self.name_codes = np.asarray(name_codes, dtype=np.int32)
+        self.flow_codes = np.asarray(flow_codes, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.path_codes = np.asarray(path_codes, dtype=np.int32)
+        self._keys = pd.Index(self.pack(self.name_codes, self.flow_codes))
+
+    @classmethod
+    def from_paths(cls, table, name_codes, flow_codes, paths):
+        lengths = np.fromiter((len(path) for path in paths), dtype=np.int64, count=len(paths))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        path_codes = np.fromiter((code for path in paths for code in path), dtype=np.int32, count=int(offsets[-1]))
+        return cls(table, name_codes, flow_codes, offsets, path_codes)
+
+    @classmethod
+    def from_dict(cls, table, hierarchy):
+        def encode(name):
+            return table.intern(name) if isinstance(name, str) else -1
+        keys = list(hierarchy)
+        paths = [[encode(name) for name in hierarchy[key]] for key in keys]
+        return cls.from_paths(table, [encode(name) for name, _ in keys], [encode(flow_to) for _, flow_to in keys],
+                              paths)
 
+    @staticmethod
+    def pack(name_codes, flow_codes):
+        # Пара кодів -> одне int64 для пошуку по індексу
+        return ((np.asarray(name_codes, dtype=np.int64) + 1) << 32) | (np.asarray(flow_codes, dtype=np.int64) + 1)
+
+    def rows(self, name_codes, flow_codes):
+        # Рядок ієрархії для кожної пари кодів; -1, якщо пари немає
+        return self._keys.get_indexer(self.pack(name_codes, flow_codes))
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def path(self, row):
+        return self.table.decode(self.path_codes[self.offsets[row]:self.offsets[row + 1]]).tolist()
+
+    def __len__(self):
+        return len(self.name_codes)
+
+    def __iter__(self):
+        names = self.table.decode(self.name_codes)
+        flows_to = self.table.decode(self.flow_codes)
+        return iter(zip(names.tolist(), flows_to.tolist()))
+
+    def __contains__(self, key):
+        return self.row(key) >= 0
+
+    def __getitem__(self, key):
+        row = self.row(key)
+        if row < 0:
+            raise KeyError(key)
+        return self.path(row)
+
+    def row(self, key):
+        name, flow_to = key
+        name_code = self.table.code(name) if isinstance(name, str) else -1
+        flow_code = self.table.code(flow_to) if isinstance(flow_to, str) else -1
+        return int(self.rows([name_code], [flow_code])[0])
+
+    def get(self, key, default=None):
+        row = self.row(key)
+        return self.path(row) if row >= 0 else default
+
+    def values(self):
+        return [self.path(row) for row in range(len(self))]
+
+    def items(self):
+        return zip(self, self.values())
+
+
+class RiverFlowGraph:
+    # Орієнтований граф стоку "річка -> куди впадає", побудований за один прохід по шару.
+    # Вершини - коди таблиці назв; шляхи вниз за течією кешуються, тож спільні хвости обчислюються один раз.
+
+    def __init__(self, names, flows_to, terminals=SEAS, table=None):
+        self.table = table if table is not None else RiverNameTable()
+        self.terminals = frozenset(self.table.intern(terminal) for terminal in terminals)
+        name_codes = self.table.encode(names)
+        flow_codes = self.table.encode(flows_to)
+        empty = self.table.code('')
+        self.downstream = {}
+        self._normalized = {}
+        for name_code, flow_code in zip(name_codes.tolist(), flow_codes.tolist()):
+            if name_code < 0:
+                continue
+            # Апострофи нормалізуються один раз для кожної назви
+            key = self.normalized(name_code)
+            # Перший запис з назвою має пріоритет, як values[0] у пошуку по DataFrame
+            if key not in self.downstream:
+                self.downstream[key] = -1 if flow_code == empty else flow_code
+        self.cycles = []
+        self._reported_cycles = set()
+        self._paths = {}
+
+    @classmethod
+    def from_frame(cls, frame, name_column='NAME_UKR', flow_to_column='FLOW_TO', table=None):
+        return cls(frame[name_column], frame[flow_to_column], table=table)
+
+    def normalized(self, code):
+        key = self._normalized.get(code)
+        if key is None:
+            key = self._normalized[code] = self.table.intern(normalize_apostrophes(self.table.names[code]))
+        return key
+
+    def next_code(self, code):
+        flow_code = self.downstream.get(self.normalized(code), -1)
+        if flow_code < 0 or flow_code == code or flow_code in self.terminals:
+            return -1
+        return flow_code
+
+    def next_river(self, river_name):
+        flow_code = self.next_code(self.table.intern(river_name))
+        return self.table.names[flow_code] if flow_code >= 0 else None
+
+    def downstream_path(self, river_name):
+        return [self.table.names[code] for code in self.downstream_codes(self.table.intern(river_name))]
+
+    def downstream_codes(self, code):
+        path = self._paths.get(code)
+        if path is None:
+            path = self._resolve_downstream_codes(code)
+        return path
+
+    def _resolve_downstream_codes(self, code):
+        chain = [code]
+        positions = {code: 0}
+        tail = ()
+        while True:
+            flow_code = self.next_code(chain[-1])
+            if flow_code < 0:
+                break
+            if flow_code in self._paths:
+                tail = (flow_code,) + self._paths[flow_code]
+                break
+            if flow_code in positions:
+                # Цикл: шлях обривається перед повтором і не кешується
+                self._report_cycle(chain[positions[flow_code]:])
+                return tuple(chain[1:])
+            positions[flow_code] = len(chain)
+            chain.append(flow_code)
+
+        # Заповнення кешу від гирла до витоку
+        for chain_code in reversed(chain):
+            self._paths[chain_code] = tail
+            tail = (chain_code,) + tail
+        return self._paths[code]
+
+    def _report_cycle(self, cycle):
+        cycle_key = frozenset(cycle)
+        if cycle_key in self._reported_cycles:
+            return
+        self._reported_cycles.add(cycle_key)
+        cycle = [self.table.names[code] for code in cycle]
+        self.cycles.append(cycle)
+        logger.warning("Cycle in river flow graph: %s", ' -> '.join(cycle + [cycle[0]]))
+
+    def find_cycles(self):
+        for code in list(self.downstream):
+            self.downstream_codes(code)
+        return self.cycles
+
+
+def output_path(extension, directory=OUTPUT_DIR):
+    # Ім'я з часом запису, а не часом імпорту модуля
+    return os.path.join(directory, f"{OUTPUT_NAME}_{datetime.datetime.now().strftime('%H_%M_%S')}{extension}")
+
+
+class SubbasinWriter(ABC):
+    # Потоковий запис суббасейнів частинами; кожна частина перепроєктується окремо
+    extension = None
+
+    def __init__(self, crs=OUTPUT_CRS, chunk_size=OUTPUT_CHUNK_SIZE):
+        self.crs = crs
+        self.chunk_size = chunk_size
+
+    def chunks(self, subbasins):
+        for start in range(0, len(subbasins), self.chunk_size):
+            chunk = subbasins.iloc[start:start + self.chunk_size]
+            yield chunk.to_crs(self.crs) if self.crs else chunk
+
+    def output_crs(self, subbasins):
+        return pyproj.CRS.from_user_input(self.crs) if self.crs else subbasins.crs
+
+    @staticmethod
+    def attribute_schema(subbasins):
+        # Схема атрибутів за всім шаром, щоб частини з лише порожніми значеннями мали той самий тип
+        attributes = subbasins.drop(columns=subbasins.geometry.name)
+        schema = pa.Schema.from_pandas(attributes, preserve_index=False).remove_metadata()
+        # Повністю порожні колонки (наприклад, FlowTo{i}) - текстові; тип null драйвери OGR не підтримують
+        for position, field in enumerate(schema):
+            if pa.types.is_null(field.type):
+                schema = schema.set(position, field.with_type(pa.string()))
+        return schema
+
+    @staticmethod
+    def arrow_chunk(chunk, schema):
+        attributes = chunk.drop(columns=chunk.geometry.name)
+        table = pa.Table.from_pandas(attributes, schema=schema.remove(schema.get_field_index('geometry')),
+                                     preserve_index=False)
+        return table.append_column(schema.field('geometry'), pa.array(shapely.to_wkb(chunk.geometry.values)))
+
+    @abstractmethod
+    def write(self, subbasins, path):
+        pass
+
+
+class OgrWriter(SubbasinWriter):
+    # GeoJSON/FlatGeobuf через GDAL: Arrow-потік у pyogrio або fiona.writerecords по частинах
+    driver = None
+
+    def layer_options(self):
+        return {}
+
+    def write(self, subbasins, path):
+        if os.path.exists(path):
+            os.remove(path)
+        if pyogrio is not None:
+            self.write_arrow(subbasins, path)
+        else:
+            self.write_records(subbasins, path)
+
+    def write_arrow(self, subbasins, path):
+        schema = self.attribute_schema(subbasins).append(pa.field('geometry', pa.binary()))
+        batches = (batch for chunk in self.chunks(subbasins) for batch in self.arrow_chunk(chunk, schema).to_batches())
+        geometry_types = subbasins.geometry.geom_type.dropna().unique()
+        pyogrio.write_arrow(
+            pa.RecordBatchReader.from_batches(schema, batches), path, driver=self.driver,
+            geometry_name='geometry', geometry_type=geometry_types[0] if len(geometry_types) == 1 else 'Unknown',
+            crs=self.output_crs(subbasins).to_wkt(), layer_options=self.layer_options(),
+        )
+
+    def write_records(self, subbasins, path):
+        fiona.drvsupport.supported_drivers[self.driver] = 'rw'
+        schema = gpd.io.file.infer_schema(subbasins)
+        with fiona.open(path, 'w', driver=self.driver, schema=schema, crs=self.output_crs(subbasins).to_wkt(),
+                        **self.layer_options()) as sink:
+            for chunk in self.chunks(subbasins):
+                sink.writerecords(chunk.iterfeatures(na='null'))
+
+
+class GeoJSONWriter(OgrWriter):
+    driver = 'GeoJSON'
+    extension = '.geojson'
+
+    def __init__(self, crs=OUTPUT_CRS, chunk_size=OUTPUT_CHUNK_SIZE, precision=OUTPUT_COORDINATE_PRECISION):
+        super().__init__(crs, chunk_size)
+        # precision=None - повна точність координат
+        self.precision = precision
+
+    def layer_options(self):
+        return {'COORDINATE_PRECISION': self.precision} if self.precision is not None else {}
+
+
+class FlatGeobufWriter(OgrWriter):
+    driver = 'FlatGeobuf'
+    extension = '.fgb'
+
+    def layer_options(self):
+        return {'SPATIAL_INDEX': 'YES'}
+
+
+class GeoParquetWriter(SubbasinWriter):
+    # Кожна частина - окрема група рядків; метадані "geo" за специфікацією GeoParquet 1.0
+    extension = '.parquet'
+
+    def write(self, subbasins, path):
+        schema = self.attribute_schema(subbasins).append(pa.field('geometry', pa.binary()))
+        crs = self.output_crs(subbasins)
+        geo_metadata = {
+            'version': '1.0.0',
+            'primary_column': 'geometry',
+            'columns': {'geometry': {
+                'encoding': 'WKB',
+                'geometry_types': sorted(subbasins.geometry.geom_type.dropna().unique().tolist()),
+                'crs': crs.to_json_dict() if crs else None,
+            }},
+        }
+        schema = schema.with_metadata({b'geo': json.dumps(geo_metadata).encode()})
+        with pq.ParquetWriter(path, schema) as sink:
+            for chunk in self.chunks(subbasins):
+                sink.write_table(self.arrow_chunk(chunk, schema))
+
+
+OUTPUT_WRITERS = {
+    'geojson': GeoJSONWriter,
+    'flatgeobuf': FlatGeobufWriter,
+    'geoparquet': GeoParquetWriter,
+}
 
 class GeoDataBuilder(ABC):
 
@@ -87,70 +961,218 @@ class GeoDataBuilder(ABC):
 
 class SubbasinBuilder(GeoDataBuilder):
 
-    def __init__(self):
-        self.subbasins_df = gpd.read_file(SUBBASINS_PATH)
-        self.rivers = gpd.read_file(RIVERS_PATH)
-        self.rivers_new = gpd.read_file(RIVERS_NEW_PATH)
-        self.riv1 = gpd.read_file(RIV1_PATH)
+    def __init__(self, subbasins_path=SUBBASINS_PATH, rivers_path=RIVERS_PATH, rivers_new_path=RIVERS_NEW_PATH,
+                 riv1_path=RIV1_PATH, clip_to_subbasins=True, bbox_padding=LAYER_BBOX_PADDING,
+                 cache_dir=INTERSECTIONS_CACHE_DIR, cache_max_entries=INTERSECTIONS_CACHE_MAX_ENTRIES,
+                 cache_max_bytes=INTERSECTIONS_CACHE_MAX_BYTES, hash_file_contents=False, workers=1,
+                 tile_size=None, spill_dir=None):
+        self.subbasins_path = subbasins_path
+        self.rivers_path = rivers_path
+        self.rivers_new_path = rivers_new_path
+        self.riv1_path = riv1_path
+        self.clip_to_subbasins = clip_to_subbasins
+        self.bbox_padding = bbox_padding
+        # workers > 1 вмикає паралельне виконання геометричних етапів
+        self.workers = workers
+        # tile_size вмикає позаядерний режим: riv1 і річки читаються плитками, результати плиток - на диск
+        if tile_size is not None and pyogrio is None:
+            raise ImportError("pyogrio is required for tiled processing")
+        self.tile_size = tile_size
+        self.spill_dir = spill_dir
+        self.riv1_buffers = []
+        # Назви річок у шарах і колонках суббасейнів - коди цієї таблиці
+        self.names = RiverNameTable()
+        self.subbasins_df = read_layer(subbasins_path)
         self.subbasins = self.subbasins_df.copy()
         self.original_geometry = self.subbasins['geometry'].copy()
-        self.rivers_sindex = self.rivers.sindex
-        self.rivers_new_sindex = self.rivers_new.sindex
-        self.riv1_sindex = self.riv1.sindex
-        self.subbasins_sindex = self.subbasins.sindex
+        # Шари річок, ієрархія та просторові індекси завантажуються при першому зверненні
+        self._rivers = None
+        self._rivers_new = None
+        self._riv1 = None
+        self._rivers_sindex = None
+        # Шари, прочитані один раз для кількох запусків (run_batch)
+        self.shared_layers = None
+        self._flow_graph = None
+        self._hierarchy = None
+        self._river_lines = {}
         self.main_river_geometries = {}
         self.intersecting_subbasins_dict = {}
-        self.hierarchy = self.build_river_hierarchy()
-
+        self.riv1_buffer_size = 0
+        self.hash_file_contents = hash_file_contents
+        # cache_dir=None вимикає кешування перетинів
+        self.intersections_cache = (IntersectionCache(cache_dir, cache_max_entries, cache_max_bytes)
+                                    if cache_dir else None)
+        # Хеші об'єктів riv1 і річок та пари "річка - Subbasin" для інкрементного режиму
+        self.feature_tables = {}
+
+    def clip_bbox(self, path):
+        # Охоплення суббасейнів з запасом у CRS шару; None - шар читається повністю
+        return self.layer_bbox(read_layer_crs(path)) if self.clip_to_subbasins else None
+
+    def layer_bbox(self, layer_crs):
+        if not self.clip_to_subbasins or layer_crs is None or self.subbasins_df.crs is None:
+            return None
+        padding = self.bbox_padding
+        if layer_crs.is_geographic:
+            padding = padding / _METERS_PER_DEGREE
+        minx, miny, maxx, maxy = self.subbasins_df.to_crs(layer_crs).total_bounds
+        return (minx - padding, miny - padding, maxx + padding, maxy + padding)
+
+    def read_clipped_layer(self, path, columns):
+        # Читання лише потрібних колонок і об'єктів у межах охоплення суббасейнів
+        return read_layer(path, columns=columns, bbox=self.clip_bbox(path))
+
+    def tiles(self, path):
+        # Сітка прямокутників, що точно покриває охоплення шару (у його CRS)
+        bbox = self.clip_bbox(path)
+        minx, miny, maxx, maxy = bbox if bbox is not None else pyogrio.read_info(path, force_total_bounds=True)['total_bounds']
+        tile_size = self.tile_size
+        layer_crs = read_layer_crs(path)
+        if layer_crs is not None and layer_crs.is_geographic:
+            tile_size = tile_size / _METERS_PER_DEGREE
+        xs = np.linspace(minx, maxx, max(1, int(np.ceil((maxx - minx) / tile_size))) + 1)
+        ys = np.linspace(miny, maxy, max(1, int(np.ceil((maxy - miny) / tile_size))) + 1)
+        for y0, y1 in zip(ys[:-1], ys[1:]):
+            for x0, x1 in zip(xs[:-1], xs[1:]):
+                yield (x0, y0, x1, y1)
+
+    def rivers_crs(self):
+        # У позаядерному режимі CRS береться з метаданих, без читання шару
+        return read_layer_crs(self.rivers_path) if self.tile_size else self.rivers.crs
+
+    def intern_columns(self, layer, columns):
+        return intern_layer_columns(self.names, layer, columns)
+
+    @property
+    def rivers(self):
+        if self._rivers is None:
+            self._rivers = self.intern_columns(self.read_clipped_layer(self.rivers_path, RIVERS_COLUMNS), RIVERS_COLUMNS)
+        return self._rivers
+
+    @rivers.setter
+    def rivers(self, value):
+        self._rivers = self.intern_columns(value, RIVERS_COLUMNS)
+        self._rivers_sindex = None
+        self._river_lines = {}
+
+    @property
+    def rivers_new(self):
+        if self._rivers_new is None:
+            # Ієрархія FLOW_TO будується з атрибутів: шар читається повністю, щоб ланцюжки стоку
+            # не обривалися на межі охоплення суббасейнів
+            if self.shared_layers is not None:
+                rivers_new = self.shared_layers.rivers_new
+            else:
+                rivers_new = read_layer(self.rivers_new_path, columns=RIVERS_NEW_COLUMNS)
+            self._rivers_new = self.intern_columns(rivers_new, RIVERS_NEW_COLUMNS)
+        return self._rivers_new
+
+    @rivers_new.setter
+    def rivers_new(self, value):
+        self._rivers_new = self.intern_columns(value, RIVERS_NEW_COLUMNS)
+        self._flow_graph = None
+        self._hierarchy = None
+
+    @property
+    def riv1(self):
+        if self._riv1 is None:
+            self._riv1 = self.read_clipped_layer(self.riv1_path, RIV1_COLUMNS)
+        return self._riv1
+
+    @riv1.setter
+    def riv1(self, value):
+        self._riv1 = value
+
+    # Просторові індекси GeoPandas будуються ліниво і скидаються при зміні геометрії
+    @property
+    def rivers_sindex(self):
+        # У пакетному режимі - спільне дерево повного шару, обмежене вибіркою rivers
+        if self._rivers_sindex is not None:
+            return self._rivers_sindex
+        return self.rivers.sindex
+
+    @rivers_sindex.setter
+    def rivers_sindex(self, value):
+        self._rivers_sindex = value
+
+    @property
+    def rivers_new_sindex(self):
+        return self.rivers_new.sindex
+
+    @property
+    def riv1_sindex(self):
+        return self.riv1.sindex
+
+    @property
+    def subbasins_sindex(self):
+        return self.subbasins.sindex
+
+    @property
+    def flow_graph(self):
+        if self._flow_graph is None:
+            self._flow_graph = RiverFlowGraph.from_frame(self.rivers_new, table=self.names)
+        return self._flow_graph
+
+    @property
+    def hierarchy(self):
+        if self._hierarchy is None:
+            self._hierarchy = self.build_river_hierarchy()
+        return self._hierarchy
+
+    @hierarchy.setter
+    def hierarchy(self, value):
+        # Словник "(річка, куди впадає) -> ланцюжок" перетворюється на масиви кодів
+        self._hierarchy = RiverHierarchy.from_dict(self.names, value) if isinstance(value, dict) else value
 
     def check_and_change_crs(self):
-        target_crs = self.rivers.crs
+        target_crs = self.rivers_crs()
         if self.subbasins.crs != target_crs:
             self.subbasins = self.subbasins.to_crs(target_crs)
-        if self.riv1.crs != target_crs:
+        # У позаядерному режимі riv1 перепроєктується по плитках
+        if not self.tile_size and self.riv1.crs != target_crs:
             self.riv1 = self.riv1.to_crs(target_crs)
 
+    def map_geometries(self, geometries, operations):
+        # Послідовні buffer/simplify над GeoSeries; при workers > 1 - частинами в пулі процесів
+        if self.workers <= 1:
+            for operation, value in operations:
+                if operation == 'buffer':
+                    geometries = geometries.buffer(value)
+                else:
+                    geometries = geometries.simplify(tolerance=value)
+            return geometries
+
+        chunks = np.array_split(shapely.to_wkb(geometries.values), self.workers * PARTITIONS_PER_WORKER)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(apply_geometry_operations, chunks, repeat(tuple(operations))))
+        return gpd.GeoSeries(shapely.from_wkb(np.concatenate(results)), index=geometries.index, crs=geometries.crs)
+
     def geometry_buffer_subbasins(self, buffer_size=0):
-        self.subbasins['geometry'] = self.subbasins['geometry'].buffer(buffer_size)
+        self.subbasins['geometry'] = self.map_geometries(self.subbasins['geometry'], [('buffer', buffer_size)])
 
     def geometry_buffer_riv1(self, buffer_size=0):
-        self.riv1['geometry'] = self.riv1['geometry'].buffer(buffer_size)
+        # У позаядерному режимі буфер застосовується до кожної плитки riv1 під час аналізу
+        if self.tile_size:
+            self.riv1_buffers.append(buffer_size)
+        else:
+            self.riv1['geometry'] = self.map_geometries(self.riv1['geometry'], [('buffer', buffer_size)])
+        self.riv1_buffer_size += buffer_size
 
     def build_river_hierarchy(self):
-        river_hierarchy = {}
-        for _, row in self.rivers_new.iterrows():
-            river_name = row['NAME_UKR']
-            flows_into = row['FLOW_TO']
-
-            if river_name and flows_into:
-                key = (river_name, flows_into)
-                if key not in river_hierarchy:
-                    river_hierarchy[key] = self.get_river_hierarchy(flows_into)
-
-        return river_hierarchy
+        name_codes = self.names.encode(self.rivers_new['NAME_UKR'])
+        flow_codes = self.names.encode(self.rivers_new['FLOW_TO'])
+        # Лише пари непорожніх назв, у порядку першої появи
+        empty = self.names.code('')
+        named = (name_codes >= 0) & (flow_codes >= 0) & (name_codes != empty) & (flow_codes != empty)
+        pairs = pd.DataFrame({'name': name_codes[named], 'flow_to': flow_codes[named]}).drop_duplicates()
+        paths = [self.flow_graph.downstream_codes(flow_code) for flow_code in pairs['flow_to'].tolist()]
+        return RiverHierarchy.from_paths(self.names, pairs['name'].to_numpy(), pairs['flow_to'].to_numpy(), paths)
+
+    def downstream_path(self, river_name):
+        return self.flow_graph.downstream_path(river_name)
 
     def get_river_hierarchy(self, river_name):
-        hierarchy = []
-        seas = ["Чорне море", "Азовське море"]
-
-        while True:
-            # Нормалізація апострофів у назві річки
-            normalized_river_name = river_name.replace("'", "’")
-
-            # Екранування апострофів для пошуку в DataFrame
-            escaped_river_name = normalized_river_name.replace("'", "\\'")
-
-            matching_rivers = self.rivers_new[self.rivers_new['NAME_UKR'] == escaped_river_name]
-            if matching_rivers.empty:
-                break
-            flow_to = matching_rivers['FLOW_TO'].values[0]
-            if not flow_to or flow_to == river_name or flow_to in seas:
-                break
-
-            hierarchy.append(flow_to)
-            river_name = flow_to
-
-        return hierarchy
+        return self.downstream_path(river_name)
 
     def get_intersecting_geometries(self, geometry, gdf, sindex):
         possible_matches_index = list(sindex.intersection(geometry.bounds))
@@ -170,16 +1192,30 @@ class SubbasinBuilder(GeoDataBuilder):
     def get_river_for_subbasin(self, main_river_name, add_prefix=True):
         if main_river_name is None or main_river_name == 'None':
             return None
-        canal_indicators = ["канал", "магістральний", "рч-2", "чорноморський", "роздольненська"]
-        no_prefix_indicators = ["рук.", "гирло", "лиман", "рукав", "водосховище"]
-
-        if any(indicator in main_river_name.lower() for indicator in canal_indicators):
-            return main_river_name
-        if any(indicator in main_river_name.lower() for indicator in no_prefix_indicators):
+        if _NO_PREFIX_PATTERN.search(main_river_name.lower()):
             return main_river_name
 
-        return ("р. " + str(main_river_name)) if add_prefix else main_river_name
+        return (RIVER_PREFIX + str(main_river_name)) if add_prefix else main_river_name
 
+    @staticmethod
+    def get_river_names_for_subbasins(main_river_names, add_prefix=True):
+        # Векторизований get_river_for_subbasin: регулярний вираз перевіряється лише для унікальних назв,
+        # результат - Categorical з тими ж кодами рядків
+        if not isinstance(main_river_names.dtype, pd.CategoricalDtype):
+            main_river_names = main_river_names.astype(object).astype('category')
+        # Категорії колонки - уся таблиця назв; перевіряються лише назви, що є в колонці
+        main_river_names = main_river_names.cat.remove_unused_categories()
+        names = pd.Series(main_river_names.cat.categories, dtype=object)
+        named = (names != 'None').to_numpy()
+        names = names.astype(str)
+        if add_prefix:
+            no_prefix = names.str.lower().str.contains(_NO_PREFIX_PATTERN)
+            names = names.where(no_prefix, RIVER_PREFIX + names)
+        # Різні назви можуть дати однаковий результат, тому категорії факторизуються повторно
+        mapping, categories = pd.factorize(names.where(named, None))
+        codes = main_river_names.cat.codes.to_numpy()
+        codes = np.where(codes >= 0, mapping[codes], -1)
+        return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=main_river_names.index)
 
     @staticmethod
     def get_distance_to_source(subbasin_geometry, river_source):
@@ -187,28 +1223,90 @@ class SubbasinBuilder(GeoDataBuilder):
 
     def create_subbasin_dictionary(self):
         self.subbasin_dict = {}
-        unnamed_counter = 1  # Лічильник для річок "Без назви"
-
-        for idx, subbasin in self.subbasins.iterrows():
-            main_river_name = subbasin['MainRiver']
-
-            # Перевірка на відсутність назви річки
-            if pd.isna(main_river_name) or main_river_name == 'None':
-                continue
-
-            if main_river_name == 'Без назви':
-                main_river_name += f"_{unnamed_counter}"
-                unnamed_counter += 1
-
-            if main_river_name not in self.subbasin_dict:
-                self.subbasin_dict[main_river_name] = []
-            self.subbasin_dict[main_river_name].append(idx)
+        main_rivers = self.names.encode(self.subbasins['MainRiver'])
 
-    def fragment_subbasins_by_unique_id(self):
+        # Перевірка на відсутність назви річки
+        named = (main_rivers >= 0) & (main_rivers != self.names.code('None'))
+        main_rivers = main_rivers[named]
+        unique_ids = self.names.decode(main_rivers)
+
+        # Річки "Без назви" отримують окремий номер кожна
+        unnamed = main_rivers == self.names.code('Без назви')
+        unique_ids[unnamed] = [f"Без назви_{counter}" for counter in range(1, unnamed.sum() + 1)]
+
+        for unique_id, idx in zip(unique_ids, self.subbasins.index[named]):
+            self.subbasin_dict.setdefault(unique_id, []).append(idx)
+
+    def get_river_lines(self, river_codes):
+        # Індекс "код назви -> об'єднана лінія річки", доповнюється лише потрібними назвами
+        missing = {code for code in river_codes if code >= 0 and code not in self._river_lines}
+        if missing:
+            if self.tile_size:
+                rivers = self.read_rivers_by_name(self.names.decode(list(missing)).tolist())
+            else:
+                rivers = self.rivers
+            name_codes = self.names.encode(rivers['name_ua'])
+            selected = np.isin(name_codes, list(missing))
+            rivers, name_codes = rivers[selected], name_codes[selected]
+            for code, group in rivers.groupby(name_codes, sort=False):
+                self._river_lines[code] = merge_river_line(group.geometry.values)
+            for code in missing - set(name_codes.tolist()):
+                self._river_lines[code] = None
+        return self._river_lines
+
+    def read_rivers_by_name(self, river_names):
+        # Лише лінії потрібних річок: SQL-фільтр за назвою в тому ж охопленні, що й у режимі в пам'яті
+        river_names = sorted(river_names)
+        bbox = self.clip_bbox(self.rivers_path)
+        frames = []
+        for start in range(0, len(river_names), RIVER_NAME_BATCH):
+            quoted = ("'" + river_name.replace("'", "''") + "'" for river_name in river_names[start:start + RIVER_NAME_BATCH])
+            frames.append(pyogrio.read_dataframe(self.rivers_path, columns=RIVERS_COLUMNS, bbox=bbox,
+                                                 where=f"name_ua IN ({', '.join(quoted)})",
+                                                 fid_as_index=True, use_arrow=True))
+        # Порядок об'єктів як у файлі, щоб лінії зливалися так само
+        return pd.concat(frames).sort_index()
+
+    def fragment_subbasins_by_unique_id(self, engine='linear'):
         self.create_subbasin_dictionary()
-        for unique_id, subbasin_indices in self.subbasin_dict.items():
-            subbasins_group = self.subbasins.iloc[subbasin_indices]
-            self.perform_fragmentation_for_group(subbasins_group, unique_id)
+        if engine == 'linear':
+            self.fragment_subbasins_linear()
+        elif engine == 'loop':
+            for unique_id, subbasin_indices in self.subbasin_dict.items():
+                subbasins_group = self.subbasins.iloc[subbasin_indices]
+                self.perform_fragmentation_for_group(subbasins_group, unique_id)
+        else:
+            raise ValueError(f"Unknown fragment engine: {engine!r}, expected one of {FRAGMENT_ENGINES}")
+
+    def fragment_subbasins_linear(self):
+        if not self.subbasin_dict:
+            return
+        labels = [idx for subbasin_indices in self.subbasin_dict.values() for idx in subbasin_indices]
+        groups = np.repeat(np.arange(len(self.subbasin_dict)),
+                           [len(subbasin_indices) for subbasin_indices in self.subbasin_dict.values()])
+        positions = self.subbasins.index.get_indexer(labels)
+        main_rivers = self.names.encode(self.subbasins['MainRiver'])[positions]
+
+        # Положення центроїду кожного суббасейну вздовж головної річки від витоку
+        river_codes, inverse = np.unique(main_rivers, return_inverse=True)
+        river_lines = self.get_river_lines(river_codes.tolist())
+        lines = np.array([river_lines.get(code) for code in river_codes.tolist()], dtype=object)[inverse]
+        centroids = shapely.centroid(np.asarray(self.subbasins.geometry.values)[positions])
+        distances = pd.Series(shapely.line_locate_point(lines, centroids))
+
+        # Один groupby/rank на всі групи замість циклу по групах
+        by_group = distances.groupby(groups, sort=False)
+        fragments = by_group.rank(method='first').to_numpy()
+        fragments[by_group.transform('size').to_numpy() == 1] = np.nan
+        fragments[main_rivers == self.names.code('null')] = np.nan
+
+        column = self.subbasins['Fragment'].copy()
+        if np.isnan(fragments).any():
+            column = column.astype('float64')
+        else:
+            fragments = fragments.astype(column.dtype)
+        column.iloc[positions] = fragments
+        self.subbasins['Fragment'] = column
 
     def perform_fragmentation_for_group(self, subbasins_group, unique_id):
         main_river_name = unique_id.split("_")[0]
@@ -217,11 +1315,12 @@ class SubbasinBuilder(GeoDataBuilder):
         if pd.isna(main_river_name) or main_river_name == 'null':
             for idx in subbasins_group.index:
                 self.subbasins.at[idx, 'Fragment'] = pd.NA
-            print(f"Фрагментація пропущена для {unique_id} (немає назви річки)")
+            logger.debug("Фрагментація пропущена для %s (немає назви річки)", unique_id)
             return
 
         # Продовження звичайної логіки, якщо назва річки є
-        river_geometry = self.rivers[self.rivers['name_ua'] == main_river_name].iloc[0]['geometry']
+        river_codes = self.names.encode(self.rivers['name_ua'])
+        river_geometry = self.rivers.geometry.iloc[np.flatnonzero(river_codes == self.names.code(main_river_name))[0]]
         river_source, _ = self.get_river_source_and_mouth(river_geometry)
 
         # Обчислення відстані від центроїду підбасейну до джерела річки
@@ -230,72 +1329,196 @@ class SubbasinBuilder(GeoDataBuilder):
         # Сортування підбасейнів за відстанню до джерела
         sorted_subbasins = subbasins_group.sort_values(by='DistanceToSource')
 
-        print(f"Фрагментація для {unique_id}:")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("Фрагментація для %s:", unique_id)
         if len(sorted_subbasins) == 1:
             subbasin_index = sorted_subbasins.index[0]
             self.subbasins.at[subbasin_index, 'Fragment'] = pd.NA
-            print(f"  Один суббасейн {subbasin_index}: Фрагмент 0")
+            if debug:
+                logger.debug("  Один суббасейн %s: Фрагмент 0", subbasin_index)
         else:
-            for idx, (subbasin_index, _) in enumerate(sorted_subbasins.iterrows(), start=1):
+            for idx, subbasin_index in enumerate(sorted_subbasins.index, start=1):
                 self.subbasins.at[subbasin_index, 'Fragment'] = int(idx)
-                print(f"  Суббасейн {subbasin_index}: Фрагмент {idx}")
+                if debug:
+                    logger.debug("  Суббасейн %s: Фрагмент %s", subbasin_index, idx)
+
+    def analyze_river_intersections(self, engine='strtree', scoring='count'):
+        cache_key = self.intersections_cache_key(scoring) if self.intersections_cache else None
+        if cache_key:
+            cached = self.intersections_cache.get(cache_key)
+            if cached is not None:
+                self.max_intersections_dict = cached
+                return
+
+        # Виконання аналізу перетинів річок
+        self.max_intersections_dict = self.compute_max_intersections(engine=engine, scoring=scoring)
+        if cache_key:
+            self.intersections_cache.put(cache_key, self.max_intersections_dict)
+
+    def intersections_cache_key(self, scoring='count'):
+        # Ключ залежить від вмісту шарів, охоплення обрізання, CRS, буфера riv1, способу оцінки та версії алгоритму
+        return IntersectionCache.make_key(
+            rivers=file_fingerprint(self.rivers_path, self.hash_file_contents),
+            riv1=file_fingerprint(self.riv1_path, self.hash_file_contents),
+            clip_to_subbasins=self.clip_to_subbasins,
+            subbasins_bounds=self.subbasins_df.total_bounds.tolist() if self.clip_to_subbasins else None,
+            bbox_padding=self.bbox_padding if self.clip_to_subbasins else None,
+            rivers_crs=self.rivers_crs().to_wkt() if self.rivers_crs() else None,
+            riv1_crs=self.riv1_crs().to_wkt() if self.riv1_crs() else None,
+            riv1_buffer_size=self.riv1_buffer_size,
+            scoring=scoring,
+            algorithm_version=INTERSECTIONS_ALGORITHM_VERSION,
+        )
+
+    def riv1_crs(self):
+        return self.rivers_crs() if self.tile_size else self.riv1.crs
+
+    def compute_max_intersections(self, engine='strtree', scoring='count'):
+        if engine == 'strtree' and self.tile_size:
+            return self.compute_max_intersections_tiled(scoring=scoring)
+        if engine == 'strtree' and self.workers > 1:
+            return self.compute_max_intersections_parallel(scoring=scoring)
+        if engine == 'strtree':
+            return self.compute_max_intersections_strtree(scoring=scoring)
+        if engine == 'loop':
+            # Цикл - еталон лише для підрахунку частин перетину
+            if scoring != 'count':
+                raise ValueError("The loop engine supports only scoring='count'")
+            return self.compute_max_intersections_loop()
+        raise ValueError(f"Unknown intersection engine: {engine!r}, expected one of {INTERSECTION_ENGINES}")
+
+    def compute_max_intersections_strtree(self, riv1=None, scoring='count'):
+        # Один масовий запит до просторового індексу річок замість вкладених iterrows
+        riv1 = self.riv1 if riv1 is None else riv1
+        riv1_positions, main_rivers = select_main_rivers(
+            riv1.geometry.values,
+            self.rivers.geometry.values,
+            self.names.encode(self.rivers['name_ua']),
+            river_tree=self.rivers_sindex,
+            scoring=scoring,
+        )
+        subbasin_ids = riv1['Subbasin'].to_numpy()[riv1_positions]
+        # Якщо кілька riv1 мають один Subbasin, перемагає останній, як у циклі
+        return dict(zip(subbasin_ids, self.names.decode(main_rivers)))
+
+    def compute_max_intersections_parallel(self, scoring='count'):
+        # riv1 ділиться на просторові частини; кожна частина отримує лише річки,
+        # що перетинають охоплення її riv1, тож результат збігається з послідовним
+        riv1_geometries = np.asarray(self.riv1.geometry.values)
+        river_geometries = np.asarray(self.rivers.geometry.values)
+        # Робочі процеси отримують коди назв замість рядків
+        river_names = self.names.encode(self.rivers['name_ua'])
+        riv1_wkb = shapely.to_wkb(riv1_geometries)
+
+        jobs = []
+        for riv1_positions in partition_by_grid(riv1_geometries, self.workers * PARTITIONS_PER_WORKER):
+            _, candidates = self.rivers_sindex.query(riv1_geometries[riv1_positions])
+            river_positions = np.unique(candidates)
+            if len(river_positions) == 0:
+                continue
+            jobs.append((riv1_wkb[riv1_positions], riv1_positions,
+                         shapely.to_wkb(river_geometries[river_positions]), river_positions,
+                         river_names[river_positions]))
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            results = (list(pool.map(select_main_rivers_partition, *zip(*jobs), repeat(scoring, len(jobs))))
+                       if jobs else [])
+
+        if not results:
+            return {}
+        positions = np.concatenate([riv1_positions for riv1_positions, _ in results])
+        main_rivers = np.concatenate([names for _, names in results])
+        order = np.argsort(positions, kind='stable')
+        subbasin_ids = self.riv1['Subbasin'].to_numpy()[positions[order]]
+        return dict(zip(subbasin_ids, self.names.decode(main_rivers[order])))
+
+    def compute_max_intersections_tiled(self, scoring='count'):
+        # Плитки riv1 обробляються по черзі; riv1 на межі плиток береться один раз (за fid),
+        # результати плиток скидаються на диск і збираються в порядку fid, як у режимі в пам'яті
+        target_crs = self.rivers_crs()
+        # Річки, які прочитав би режим у пам'яті; в пам'яті тримаються лише їхні fid
+        river_fids = pyogrio.read_dataframe(self.rivers_path, bbox=self.clip_bbox(self.rivers_path),
+                                            read_geometry=False, columns=[], fid_as_index=True).index.to_numpy()
+        # fid можуть починатися з 1 і мати пропуски (GPKG), тому оброблені riv1 позначаються за позицією fid
+        riv1_fids = np.sort(pyogrio.read_dataframe(self.riv1_path, read_geometry=False, columns=[],
+                                                   fid_as_index=True).index.to_numpy())
+        processed = np.zeros(len(riv1_fids), dtype=bool)
+
+        with tempfile.TemporaryDirectory(dir=self.spill_dir) as spill_dir:
+            parts = []
+            for tile_number, tile in enumerate(self.tiles(self.riv1_path)):
+                riv1 = pyogrio.read_dataframe(self.riv1_path, columns=RIV1_COLUMNS, bbox=tile,
+                                              fid_as_index=True, use_arrow=True)
+                positions = np.searchsorted(riv1_fids, riv1.index.to_numpy())
+                riv1 = riv1[~processed[positions]]
+                processed[positions] = True
+                if riv1.empty:
+                    continue
+                if riv1.crs != target_crs:
+                    riv1 = riv1.to_crs(target_crs)
+                if self.riv1_buffers:
+                    riv1['geometry'] = self.map_geometries(riv1['geometry'],
+                                                           [('buffer', buffer_size) for buffer_size in self.riv1_buffers])
+
+                rivers = pyogrio.read_dataframe(self.rivers_path, columns=RIVERS_COLUMNS,
+                                                bbox=tuple(riv1.total_bounds), fid_as_index=True, use_arrow=True)
+                rivers = rivers[np.isin(rivers.index.to_numpy(), river_fids)]
+                riv1_positions, main_rivers = select_main_rivers(
+                    riv1.geometry.values, rivers.geometry.values, self.names.encode(rivers['name_ua']),
+                    scoring=scoring)
+
+                part_path = os.path.join(spill_dir, f"tile_{tile_number:05d}.parquet")
+                pd.DataFrame({
+                    'fid': riv1.index.to_numpy()[riv1_positions],
+                    'Subbasin': riv1['Subbasin'].to_numpy()[riv1_positions],
+                    'MainRiver': main_rivers,
+                }).to_parquet(part_path, index=False)
+                parts.append(part_path)
+                logger.debug("Tile %d: %d riv1, %d rivers", tile_number, len(riv1), len(rivers))
+
+            if not parts:
+                return {}
+            result = pd.concat([pd.read_parquet(part_path) for part_path in parts], ignore_index=True)
+        result = result.sort_values('fid', kind='stable')
+        # Якщо кілька riv1 мають один Subbasin, перемагає останній за fid, як у режимі в пам'яті
+        return dict(zip(result['Subbasin'].to_numpy(), self.names.decode(result['MainRiver'].to_numpy())))
+
+    def compute_max_intersections_loop(self):
+        max_intersections_dict = {}
+        for river1_idx, river1_row in self.riv1.iterrows():
+            subbasin_id = river1_row['Subbasin']
+            river_intersections = {}
+            for river2_idx, river2_row in self.rivers.iterrows():
+                if river1_row.geometry.intersects(river2_row.geometry):
+                    intersection = river1_row.geometry.intersection(river2_row.geometry)
+                    intersection_count = self.count_intersections(intersection)
+                    river_name = river2_row['name_ua']
+                    if river_name in river_intersections:
+                        river_intersections[river_name] += intersection_count
+                    else:
+                        river_intersections[river_name] = intersection_count
 
-        print("Фрагментація завершена\n")
+            if river_intersections:
+                main_river = max(river_intersections, key=river_intersections.get)
+                max_intersections_dict[subbasin_id] = main_river
 
-    def analyze_river_intersections(self):
-        # Перевірка, чи вже існує збережений файл
-        if os.path.exists('max_intersections_dict.csv'):
-            # Завантаження даних з файлу
-            self.load_max_intersections_dict_from_csv()
-        else:
-            # Виконання аналізу перетинів річок
-            max_intersections_dict = {}
-            for river1_idx, river1_row in self.riv1.iterrows():
-                subbasin_id = river1_row['Subbasin']
-                river_intersections = {}
-                for river2_idx, river2_row in self.rivers.iterrows():
-                    if river1_row.geometry.intersects(river2_row.geometry):
-                        intersection = river1_row.geometry.intersection(river2_row.geometry)
-                        intersection_count = self.count_intersections(intersection)
-                        river_name = river2_row['name_ua']
-                        if river_name in river_intersections:
-                            river_intersections[river_name] += intersection_count
-                        else:
-                            river_intersections[river_name] = intersection_count
-
-                if river_intersections:
-                    main_river = max(river_intersections, key=river_intersections.get)
-                    max_intersections_dict[subbasin_id] = main_river
-
-            self.max_intersections_dict = max_intersections_dict
-            # Збереження результатів у файл
-            self.save_max_intersections_dict_to_csv()
-
-    def save_max_intersections_dict_to_csv(self):
-        df = pd.DataFrame(list(self.max_intersections_dict.items()), columns=['Subbasin', 'MainRiver'])
-        df.to_csv('max_intersections_dict.csv', index=False)
-
-    def load_max_intersections_dict_from_csv(self):
-        df = pd.read_csv('max_intersections_dict.csv')
-        self.max_intersections_dict = dict(zip(df['Subbasin'], df['MainRiver']))
+        return max_intersections_dict
 
     def determine_main_river(self, subbasin_id):
         main_river_name = self.max_intersections_dict.get(subbasin_id)
         if main_river_name:
-            print(f"Main river for Subbasin {subbasin_id}: {main_river_name}")
+            logger.debug("Main river for Subbasin %s: %s", subbasin_id, main_river_name)
             return main_river_name
         else:
-            print(f"No intersecting rivers found for Subbasin {subbasin_id}")
+            logger.debug("No intersecting rivers found for Subbasin %s", subbasin_id)
             return None
 
     def update_subbasins_with_main_river(self):
-        for idx, row in self.subbasins.iterrows():
-            subbasin_id = row['Subbasin']
-            main_river_name = self.determine_main_river(subbasin_id)
-            if main_river_name:
-                self.subbasins.at[idx, 'MainRiver'] = main_river_name
-            else:
-                self.subbasins.at[idx, 'MainRiver'] = pd.NA
+        main_rivers = self.names.encode(self.subbasins['Subbasin'].map(self.max_intersections_dict))
+        # Як і determine_main_river: відсутні та порожні назви стають NA
+        main_rivers[main_rivers == self.names.code('')] = -1
+        self.subbasins['MainRiver'] = self.names.categorical(codes=main_rivers, index=self.subbasins.index)
 
     def count_intersections(self, intersection):
         if intersection.is_empty:
@@ -306,7 +1529,7 @@ class SubbasinBuilder(GeoDataBuilder):
         elif isinstance(intersection, MultiLineString):
             return sum(1 for _ in intersection.geoms)
         elif isinstance(intersection, GeometryCollection):
-            return sum(self.count_intersections(geom) for geom in intersection)
+            return sum(self.count_intersections(geom) for geom in intersection.geoms)
         else:
             return 0
 
@@ -338,14 +1561,9 @@ class SubbasinBuilder(GeoDataBuilder):
     #             self.subbasins.at[idx, 'FlowTo'] = pd.NA
 
     def compare_and_update_river_names(self):
-        for idx, row in self.subbasins.iterrows():
-            main_river_name = row['MainRiver']
-
-            if pd.notna(main_river_name):
-                correct_river_name = self.get_river_for_subbasin(main_river_name, add_prefix=True)
-                self.subbasins.at[idx, 'Name_UA'] = correct_river_name
-            else:
-                self.subbasins.at[idx, 'Name_UA'] = pd.NA
+        main_rivers = self.subbasins['MainRiver']
+        river_names = self.get_river_names_for_subbasins(main_rivers, add_prefix=True)
+        self.subbasins['Name_UA'] = self.names.categorical(river_names.where(main_rivers.notna(), pd.NA))
 
     def initialize_and_set_column_types(self):
         column_types = {
@@ -365,30 +1583,38 @@ class SubbasinBuilder(GeoDataBuilder):
                 self.subbasins[column].fillna(0, inplace=True)
                 self.subbasins[column] = self.subbasins[column].astype(int)
             else:
-                self.subbasins[column] = self.subbasins[column].astype(column_type)
+                # Текстові колонки зберігаються як коди таблиці назв
+                self.subbasins[column] = self.names.categorical(self.subbasins[column].astype(column_type))
 
     def add_hierarchy_columns(self):
 
-        max_hierarchy_length = max(len(hierarchy) for hierarchy in self.hierarchy.values())
+        hierarchy = self.hierarchy
+        lengths = hierarchy.lengths()
+        max_hierarchy_length = int(lengths.max()) if len(lengths) else 0
 
         for i in range(2, max_hierarchy_length + 1):
             column_name = f'FlowTo{i}'
             if column_name not in self.subbasins.columns:
-                self.subbasins[column_name] = pd.NA
-                self.subbasins[column_name] = self.subbasins[column_name].astype('object')
-
-        # Оновлення даних у DataFrame неар
-        for idx, row in self.subbasins.iterrows():
-            main_river_name = row['MainRiver']
-            flow_to = row['FlowTo']
-            key = (main_river_name, flow_to)
-
-            if key in self.hierarchy:
-                print(self.hierarchy)
-                for i, river in enumerate(self.hierarchy[key], start=2):
-                    print(i, river)
-                    self.subbasins.at[idx, f'FlowTo{i}'] = river
+                self.subbasins[column_name] = self.names.categorical(codes=np.full(len(self.subbasins), -1),
+                                                                     index=self.subbasins.index)
+
+        # Рядок ієрархії для кожного суббасейну за парою кодів (MainRiver, FlowTo)
+        rows = hierarchy.rows(self.names.encode(self.subbasins['MainRiver']), self.names.encode(self.subbasins['FlowTo']))
+        positions = np.flatnonzero(rows >= 0)
+        positions = positions[lengths[rows[positions]] > 0]
+        if not len(positions):
+            return
 
+        starts = hierarchy.offsets[rows[positions]]
+        path_lengths = lengths[rows[positions]]
+        for offset in range(int(path_lengths.max())):
+            column_name = f'FlowTo{offset + 2}'
+            # Коротші ланцюжки не перезаписують решту колонок
+            filled = path_lengths > offset
+            codes = (self.names.encode(self.subbasins[column_name]) if column_name in self.subbasins.columns
+                     else np.full(len(self.subbasins), -1, dtype=np.int32))
+            codes[positions[filled]] = hierarchy.path_codes[starts[filled] + offset]
+            self.subbasins[column_name] = self.names.categorical(codes=codes, index=self.subbasins.index)
 
     def remove_main_river_column(self):
         if 'MainRiver' in self.subbasins.columns:
@@ -399,99 +1625,798 @@ class SubbasinBuilder(GeoDataBuilder):
         self.subbasins['geometry'] = self.original_geometry
 
 
-    def optimize_geometry(self, buffer_size=0, simplify_tolerance=0):
-        self.geometry_buffer_subbasins(buffer_size=buffer_size)
-        # Зменшення геометрії
-            # Спрощення геометрії
-        self.subbasins['geometry'] = self.subbasins['geometry'].simplify(tolerance=simplify_tolerance)
-
-        # # Збільшення геометрії
-        # self.geometry_buffer_subbasins(buffer_size=-buffer_size)
-
-    def remove_and_merge_intersections(self):
-        for idx, subbasin in self.subbasins.iterrows():
-            # 1. Перевірка та виправлення геометрії
-            try:
-                if not subbasin['geometry'].is_valid:
-                    simplified_geometry = subbasin['geometry'].simplify(tolerance=0.01)
-                    if simplified_geometry.is_valid:
-                        subbasin['geometry'] = simplified_geometry
-                    else:
-                        subbasin['geometry'] = subbasin['geometry'].buffer(-0.01)
-            except Exception as e:
-                print(f"Error during geometry simplification or buffering: {e}")
-                continue
-
-            # 2. Знаходження можливих перетинів
-            try:
-                possible_matches_index = list(self.subbasins_sindex.intersection(subbasin['geometry'].bounds))
-            except shapely.errors.TopologyException:
-                print("Error with geometry during intersection:", subbasin['geometry'])
-                continue
+    def optimize_geometry(self, buffer_size=0, simplify_tolerance=0, mode='independent'):
+        if mode == 'independent':
+            # Зменшення і спрощення геометрії за один прохід (паралельно при workers > 1)
+            self.subbasins['geometry'] = self.map_geometries(
+                self.subbasins['geometry'], [('buffer', buffer_size), ('simplify', simplify_tolerance)])
+        elif mode == 'topology':
+            # Спочатку спрощення спільних дуг покриття (дуги - паралельно при workers > 1), потім зменшення
+            geometries = self.subbasins['geometry']
 
-            # Перевірка на наявність idx в possible_matches_index
-            if idx in possible_matches_index:
-                possible_matches_index.remove(idx)
+            def simplify_arcs(arcs):
+                arcs = gpd.GeoSeries(arcs, crs=geometries.crs)
+                return self.map_geometries(arcs, [('simplify', simplify_tolerance)]).values
 
-            possible_matches = self.subbasins.iloc[possible_matches_index]
-            try:
-                precise_matches = possible_matches[possible_matches.intersects(subbasin['geometry'])]
-            except Exception as e:
-                print(f"Error during precise intersection check: {e}")
-                continue
+            simplified = simplify_shared_arcs(geometries.values, simplify_tolerance, simplify_arcs=simplify_arcs)
+            self.subbasins['geometry'] = self.map_geometries(
+                gpd.GeoSeries(simplified, index=geometries.index, crs=geometries.crs), [('buffer', buffer_size)])
+        else:
+            raise ValueError(f"Unknown optimize mode: {mode!r}, expected one of {OPTIMIZE_MODES}")
 
-            if not precise_matches.empty:
-                # Створення списку геометрій для об'єднання
-                geometries_to_union = [subbasin['geometry']]
-                for _, intersecting_subbasin in precise_matches.iterrows():
-                    try:
-                        new_geometry = subbasin['geometry'].difference(intersecting_subbasin['geometry'])
-                        geometries_to_union.append(new_geometry)
-                    except Exception as e:
-                        print(f"Error during geometry difference: {e}")
-                        continue
-
-                # Об'єднання геометрій
-                try:
-                    merged_geometry = unary_union(geometries_to_union)
-                    self.subbasins.at[idx, 'geometry'] = merged_geometry  # Змінюємо геометрію в копії DataFrame
-                except Exception as e:
-                    print(f"Error during geometry union: {e}")
-                    continue
+        # # Збільшення геометрії
+        # self.geometry_buffer_subbasins(buffer_size=-buffer_size)
 
-                # Оновлення R-tree після зміни геометрії
-                self.subbasins_sindex = self.subbasins.sindex
-    def save_subbasains_new(self):
-        original_crs = "EPSG:4326"
-        self.subbasins = self.subbasins.to_crs(original_crs)
-        fiona.drvsupport.supported_drivers['GeoJSON'] = 'rw'
-        self.subbasins.to_file(FILE_INPUT, driver='GeoJSON')
+    def remove_and_merge_intersections(self, priority_column='Subbasin'):
+        self.resolve_overlaps(priority_column=priority_column)
+
+    def resolve_overlaps(self, priority_column='Subbasin'):
+        priority = self.subbasins[priority_column].to_numpy() if priority_column else None
+        resolved, report = resolve_overlaps(self.subbasins.geometry.values, priority=priority)
+        self.subbasins['geometry'] = gpd.GeoSeries(resolved, index=self.subbasins.index, crs=self.subbasins.crs)
+        self.overlap_report = self.describe_overlaps(report, np.arange(len(self.subbasins)))
+        logger.info("Overlaps resolved: %d subbasins changed", len(self.overlap_report))
+        return self.overlap_report
+
+    def describe_overlaps(self, report, positions):
+        # Звіт про змінені суббасейни в термінах Subbasin, а не позицій
+        subbasin_ids = self.subbasins['Subbasin'].to_numpy()[positions]
+        return pd.DataFrame({
+            'Subbasin': subbasin_ids[report['position'].to_numpy(dtype=np.int64)],
+            'fixed_invalid': report['fixed_invalid'].to_numpy(),
+            'overlaps_with': [subbasin_ids[partners].tolist() for partners in report['overlaps_with']],
+            'removed_area': report['removed_area'].to_numpy(),
+        })
+
+    def save_state(self, directory, include_riv1=False):
+        # Знімок стану між етапами у колонкових форматах (GeoParquet/Parquet + JSON)
+        os.makedirs(directory, exist_ok=True)
+        self.subbasins.to_parquet(os.path.join(directory, 'subbasins.parquet'))
+        gpd.GeoDataFrame(geometry=self.original_geometry).to_parquet(
+            os.path.join(directory, 'original_geometry.parquet'))
+        if hasattr(self, 'max_intersections_dict'):
+            write_main_rivers(os.path.join(directory, 'max_intersections.parquet'), self.max_intersections_dict)
+        if hasattr(self, 'subbasin_dict'):
+            with open(os.path.join(directory, 'subbasin_dict.json'), 'w', encoding='utf-8') as file:
+                json.dump({unique_id: [int(idx) for idx in indices] for unique_id, indices in self.subbasin_dict.items()},
+                          file, ensure_ascii=False)
+        # riv1 після буферизації потрібен лише етапам до analyze_river_intersections
+        include_riv1 = include_riv1 and self._riv1 is not None
+        if include_riv1:
+            self.riv1.to_parquet(os.path.join(directory, 'riv1.parquet'))
+        with open(os.path.join(directory, 'state.json'), 'w', encoding='utf-8') as file:
+            json.dump({'riv1_buffer_size': self.riv1_buffer_size, 'riv1_buffers': self.riv1_buffers,
+                       'riv1': include_riv1}, file)
+
+    def load_state(self, directory):
+        with open(os.path.join(directory, 'state.json'), encoding='utf-8') as file:
+            state = json.load(file)
+        self.subbasins = gpd.read_parquet(os.path.join(directory, 'subbasins.parquet'))
+        self.original_geometry = gpd.read_parquet(os.path.join(directory, 'original_geometry.parquet')).geometry
+        max_intersections_path = os.path.join(directory, 'max_intersections.parquet')
+        if os.path.exists(max_intersections_path):
+            self.max_intersections_dict = read_main_rivers(max_intersections_path)
+        subbasin_dict_path = os.path.join(directory, 'subbasin_dict.json')
+        if os.path.exists(subbasin_dict_path):
+            with open(subbasin_dict_path, encoding='utf-8') as file:
+                self.subbasin_dict = json.load(file)
+        self.riv1_buffer_size = state['riv1_buffer_size']
+        self.riv1_buffers = state.get('riv1_buffers', [])
+        if state['riv1']:
+            self.riv1 = gpd.read_parquet(os.path.join(directory, 'riv1.parquet'))
+
+    def river_features(self):
+        return pd.DataFrame({
+            'hash': feature_hashes(self.rivers.geometry.values, self.rivers['name_ua']),
+            'name_ua': self.rivers['name_ua'].to_numpy(dtype=object),
+        })
 
+    @staticmethod
+    def riv1_features(riv1):
+        return pd.DataFrame({
+            'hash': feature_hashes(riv1.geometry.values, riv1['Subbasin']),
+            'Subbasin': riv1['Subbasin'].to_numpy(),
+        })
+
+    def river_pairs(self, riv1, river_hashes):
+        # Річки в межах буфера від riv1 (без буферизації) - надмножина пар, що перетинаються на етапі аналізу
+        riv1_idx, river_idx = self.rivers_sindex.query(riv1.geometry.values, predicate='dwithin',
+                                                       distance=max(self.riv1_buffer_size, 0))
+        return pd.DataFrame({
+            'river_hash': river_hashes[river_idx],
+            'Subbasin': riv1['Subbasin'].to_numpy()[riv1_idx],
+        }).drop_duplicates()
+
+    def layers_changed(self, state, name, path):
+        # Шар перечитується і порівнюється за хешами лише якщо змінився файл або охоплення суббасейнів
+        return (state['fingerprints'][name] != file_fingerprint(path, self.hash_file_contents)
+                or state['bounds'] != self.subbasins_df.total_bounds.tolist())
+
+    def save_run_state(self, directory, stages):
+        # Результат, хеші вхідних об'єктів і пари "річка - Subbasin" для наступного інкрементного запуску
+        os.makedirs(directory, exist_ok=True)
+        if 'rivers' not in self.feature_tables:
+            self.feature_tables['rivers'] = self.river_features()
+        if 'riv1' not in self.feature_tables or 'river_pairs' not in self.feature_tables:
+            # Після повного запуску riv1 у пам'яті вже з буфером, тож хеші рахуються з вихідного шару
+            riv1 = self.read_clipped_layer(self.riv1_path, RIV1_COLUMNS)
+            if riv1.crs != self.rivers.crs:
+                riv1 = riv1.to_crs(self.rivers.crs)
+            self.feature_tables['riv1'] = self.riv1_features(riv1)
+            self.feature_tables['river_pairs'] = self.river_pairs(riv1, self.feature_tables['rivers']['hash'].to_numpy())
+
+        self.subbasins.to_parquet(os.path.join(directory, 'subbasins.parquet'))
+        gpd.GeoDataFrame({
+            'Subbasin': self.subbasins['Subbasin'].to_numpy(),
+            'hash': feature_hashes(self.original_geometry.values),
+        }, geometry=self.original_geometry.values, crs=self.original_geometry.crs).to_parquet(
+            os.path.join(directory, 'original_geometry.parquet'))
+        write_main_rivers(os.path.join(directory, 'max_intersections.parquet'), self.max_intersections_dict)
+        for name in RUN_STATE_TABLES:
+            self.feature_tables[name].to_parquet(os.path.join(directory, f'{name}.parquet'), index=False)
+
+        # state.json записується останнім і позначає завершений стан
+        with open(os.path.join(directory, 'state.json'), 'w', encoding='utf-8') as file:
+            json.dump({
+                'version': RUN_STATE_VERSION,
+                'stages': run_state_stages(stages),
+                'fingerprints': {
+                    'rivers': file_fingerprint(self.rivers_path, self.hash_file_contents),
+                    'riv1': file_fingerprint(self.riv1_path, self.hash_file_contents),
+                },
+                'bounds': self.subbasins_df.total_bounds.tolist(),
+                'riv1_buffer_size': self.riv1_buffer_size,
+            }, file, ensure_ascii=False)
+
+    def update_incrementally(self, directory, stages):
+        # Перерахунок головної річки, фрагментів, назв і геометрії лише для змінених суббасейнів
+        # та груп річок; решта береться з попереднього результату. False - потрібен повний запуск.
+        with open(os.path.join(directory, 'state.json'), encoding='utf-8') as file:
+            state = json.load(file)
+        if state['version'] != RUN_STATE_VERSION or state['stages'] != run_state_stages(stages):
+            logger.info("Run state in %s does not match the pipeline, running it in full", directory)
+            return False
+        if not self.subbasins['Subbasin'].is_unique:
+            logger.info("Subbasin ids are not unique, running the pipeline in full")
+            return False
+
+        stage_kwargs = dict(stages)
+        previous = gpd.read_parquet(os.path.join(directory, 'subbasins.parquet'))
+        previous_original = gpd.read_parquet(os.path.join(directory, 'original_geometry.parquet'))
+        previous_main_rivers = read_main_rivers(os.path.join(directory, 'max_intersections.parquet'))
+        tables = {name: pd.read_parquet(os.path.join(directory, f'{name}.parquet')) for name in RUN_STATE_TABLES}
+        self.max_intersections_dict = dict(previous_main_rivers)
+        self.riv1_buffer_size = state['riv1_buffer_size']
+
+        self.check_and_change_crs()
+        self.initialize_and_set_column_types()
+        subbasin_ids = self.subbasins['Subbasin'].to_numpy()
+
+        # Суббасейни з новою, зміненою або видаленою геометрією
+        previous_hashes = dict(zip(previous_original['Subbasin'].to_numpy(), previous_original['hash'].to_numpy()))
+        current_hashes = feature_hashes(self.original_geometry.values)
+        reshaped = {subbasin_id for subbasin_id, feature_hash in zip(subbasin_ids, current_hashes)
+                    if previous_hashes.get(subbasin_id) != feature_hash}
+        removed = set(previous_hashes) - set(subbasin_ids)
+
+        # Subbasin, чиї riv1 змінилися
+        main_ids = set()
+        if self.layers_changed(state, 'riv1', self.riv1_path):
+            riv1_table = self.riv1_features(self.riv1)
+            changed = changed_hashes(tables['riv1']['hash'], riv1_table['hash'])
+            for table in (tables['riv1'], riv1_table):
+                main_ids.update(table.loc[table['hash'].isin(changed), 'Subbasin'])
+            tables['riv1'] = riv1_table
+
+        # Subbasin поруч зі зміненими річками: старі положення з пар, нові - запитом до індексу riv1
+        changed_names = set()
+        if self.layers_changed(state, 'rivers', self.rivers_path):
+            river_table = self.river_features()
+            changed = changed_hashes(tables['rivers']['hash'], river_table['hash'])
+            pairs = tables['river_pairs']
+            main_ids.update(pairs.loc[pairs['river_hash'].isin(changed), 'Subbasin'])
+            added = river_table['hash'].isin(changed).to_numpy()
+            if added.any():
+                _, riv1_idx = self.riv1_sindex.query(self.rivers.geometry.values[added], predicate='dwithin',
+                                                     distance=max(self.riv1_buffer_size, 0))
+                main_ids.update(self.riv1['Subbasin'].to_numpy()[riv1_idx])
+            for table in (tables['rivers'], river_table):
+                changed_names.update(table.loc[table['hash'].isin(changed), 'name_ua'].dropna())
+            tables['rivers'] = river_table
+
+        if main_ids:
+            riv1 = self.riv1[self.riv1['Subbasin'].isin(list(main_ids))]
+            buffered = riv1.copy()
+            buffered['geometry'] = self.map_geometries(riv1['geometry'], [('buffer', self.riv1_buffer_size)])
+            for subbasin_id in main_ids:
+                self.max_intersections_dict.pop(subbasin_id, None)
+            scoring = stage_kwargs.get('analyze_river_intersections', {}).get('scoring', 'count')
+            self.max_intersections_dict.update(self.compute_max_intersections_strtree(buffered, scoring=scoring))
+            pairs = tables['river_pairs']
+            tables['river_pairs'] = pd.concat([
+                pairs[~pairs['Subbasin'].isin(list(main_ids))],
+                self.river_pairs(riv1, tables['rivers']['hash'].to_numpy()),
+            ], ignore_index=True)
+        self.feature_tables = tables
+
+        self.update_subbasins_with_main_river()
+        self.compare_and_update_river_names()
+
+        # Групи річок, у яких змінився склад, положення суббасейнів або лінія річки
+        def river_group(river_name):
+            return river_name if isinstance(river_name, str) and river_name else None
+
+        groups = set(changed_names)
+        for subbasin_id in removed:
+            groups.add(river_group(previous_main_rivers.get(subbasin_id)))
+        for subbasin_id, main_river in zip(subbasin_ids, self.subbasins['MainRiver'].to_numpy(dtype=object)):
+            if subbasin_id in reshaped or subbasin_id in main_ids:
+                groups.add(river_group(main_river))
+                if subbasin_id in previous_hashes:
+                    groups.add(river_group(previous_main_rivers.get(subbasin_id)))
+        groups.discard(None)
+
+        # Змінені суббасейни поза перерахованими групами отримують початкове значення, як у повному запуску
+        previous_fragments = dict(zip(previous['Subbasin'].to_numpy(), previous['Fragment'].to_numpy()))
+        stale = reshaped | main_ids
+        fragments = pd.Series([fragment if subbasin_id in stale else previous_fragments.get(subbasin_id, fragment)
+                               for subbasin_id, fragment in zip(subbasin_ids, self.subbasins['Fragment'].to_numpy())],
+                              index=self.subbasins.index, dtype='float64')
+        group_rows = self.subbasins['MainRiver'].isin(list(groups)).to_numpy()
+        if group_rows.any():
+            group_builder = copy.copy(self)
+            group_builder.subbasins = self.subbasins[group_rows].copy()
+            if 'optimize_geometry' in stage_kwargs:
+                group_builder.optimize_geometry(**stage_kwargs['optimize_geometry'])
+            group_builder.fragment_subbasins_by_unique_id(**stage_kwargs.get('fragment_subbasins_by_unique_id', {}))
+            fragments[group_rows] = group_builder.subbasins['Fragment'].to_numpy(dtype='float64')
+        if not fragments.isna().any():
+            fragments = fragments.astype(self.subbasins['Fragment'].dtype)
+        self.subbasins['Fragment'] = fragments
+
+        self.remove_main_river_column()
+        self.restore_original_geometry()
+        region_size = self.patch_overlaps(previous, previous_original, reshaped, removed,
+                                          stage_kwargs.get('remove_and_merge_intersections'))
+
+        logger.info("Incremental update: %d subbasins reshaped, %d removed, %d main rivers recomputed, "
+                    "%d river groups refragmented, %d geometries re-resolved",
+                    len(reshaped), len(removed), len(main_ids), len(groups), region_size)
+        return True
+
+    def patch_overlaps(self, previous, previous_original, reshaped, removed, overlap_kwargs):
+        # Усунення перекриттів лише для змінених суббасейнів і сусідів їхньої старої та нової геометрії
+        if overlap_kwargs is None:
+            return 0
+        geometries = np.asarray(self.subbasins.geometry.values)
+        subbasin_ids = self.subbasins['Subbasin'].to_numpy()
+        previous_geometry = dict(zip(previous['Subbasin'].to_numpy(), np.asarray(previous.geometry.values)))
+        resolved_geometries = np.array([previous_geometry.get(subbasin_id) for subbasin_id in subbasin_ids],
+                                       dtype=object)
+
+        reshaped_rows = np.isin(subbasin_ids, list(reshaped))
+        old_shapes = np.asarray(previous_original.geometry.values)[
+            previous_original['Subbasin'].isin(list(reshaped | removed)).to_numpy()]
+        tree = shapely.STRtree(geometries)
+        _, neighbours = tree.query(np.concatenate([geometries[reshaped_rows], old_shapes]))
+        region = np.union1d(neighbours, np.flatnonzero(reshaped_rows))
+        _, context = tree.query(geometries[region])
+        context = np.union1d(context, region)
+
+        priority_column = overlap_kwargs.get('priority_column', 'Subbasin')
+        priority = self.subbasins[priority_column].to_numpy()[context] if priority_column else None
+        resolved, report = resolve_overlaps(geometries[context], priority=priority)
+        in_region = np.isin(context, region)
+        resolved_geometries[context[in_region]] = resolved[in_region]
+        self.subbasins['geometry'] = gpd.GeoSeries(resolved_geometries, index=self.subbasins.index,
+                                                   crs=self.subbasins.crs)
+
+        report = report[in_region[report['position'].to_numpy(dtype=np.int64)]]
+        self.overlap_report = self.describe_overlaps(report, context)
+        return len(region)
+
+    def save_subbasains_new(self, output_format='geojson', path=None, directory=OUTPUT_DIR, **writer_options):
+        if output_format not in OUTPUT_WRITERS:
+            raise ValueError(f"Unknown output format: {output_format!r}, expected one of {tuple(OUTPUT_WRITERS)}")
+        writer = OUTPUT_WRITERS[output_format](**writer_options)
+        self.output_path = path or output_path(writer.extension, directory)
+        os.makedirs(os.path.dirname(self.output_path) or '.', exist_ok=True)
+        # Назви декодуються лише тут, на виході
+        writer.write(decode_categories(self.subbasins), self.output_path)
+        logger.info("Saved %d subbasins to %s", len(self.subbasins), self.output_path)
+        return self.output_path
+
+
+
+def peak_rss_bytes():
+    # Піковий резидентний обсяг пам'яті процесу, None якщо недоступний
+    if resource is not None:
+        return rusage_maxrss_bytes(resource.RUSAGE_SELF)
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss)
+    return None
+
+
+def rusage_maxrss_bytes(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux повертає кілобайти, macOS - байти
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss_bytes():
+    # Поточний резидентний обсяг пам'яті процесу; без psutil - None
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def children_peak_rss_bytes():
+    # Найбільший піковий обсяг серед завершених дочірніх процесів (пул workers); None на Windows
+    if resource is None:
+        return None
+    return rusage_maxrss_bytes(resource.RUSAGE_CHILDREN)
+
+
+def children_cpu_seconds():
+    # CPU завершених дочірніх процесів (пул workers); 0 на Windows
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class PipelineInstrumentation:
+    # Час, CPU, пам'ять і розміри даних для кожного етапу конвеєра + необов'язковий профіль
+
+    PROFILERS = (None, 'cprofile', 'pyinstrument')
+
+    def __init__(self, profiler=None, profile_dir='profiles', count_vertices=True):
+        if profiler not in self.PROFILERS:
+            raise ValueError(f"Unknown profiler: {profiler!r}, expected one of {self.PROFILERS}")
+        if profiler == 'pyinstrument' and pyinstrument is None:
+            raise ImportError("pyinstrument is required for profiler='pyinstrument'")
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.count_vertices = count_vertices
+        self.started_at = datetime.datetime.now().isoformat(timespec='seconds')
+        self.stages = []
+
+    def measure(self, builder):
+        subbasins = builder.subbasins
+        geometries = np.asarray(subbasins.geometry.values) if subbasins.geometry.name in subbasins else None
+        counts = {'rows': len(subbasins)}
+        if geometries is not None:
+            counts['geometries'] = int((~shapely.is_empty(geometries) & ~shapely.is_missing(geometries)).sum())
+            if self.count_vertices:
+                counts['vertices'] = int(shapely.get_num_coordinates(geometries).sum())
+        return counts
+
+    def start_profiler(self):
+        if self.profiler == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        if self.profiler == 'pyinstrument':
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            return profiler
+        return None
+
+    def stop_profiler(self, profiler, stage_name):
+        if profiler is None:
+            return None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base_path = os.path.join(self.profile_dir, f"{len(self.stages):02d}_{stage_name}")
+        if self.profiler == 'cprofile':
+            profiler.disable()
+            path = base_path + '.prof'
+            profiler.dump_stats(path)
+        else:
+            profiler.stop()
+            path = base_path + '.txt'
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(profiler.output_text())
+        return path
+
+    @contextmanager
+    def stage(self, stage_name, builder):
+        counts_in = self.measure(builder)
+        rss_before = current_rss_bytes()
+        peak_before = peak_rss_bytes()
+        children_cpu_before = children_cpu_seconds()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        profiler = self.start_profiler()
+        status = 'ok'
+        try:
+            yield
+        except BaseException:
+            status = 'failed'
+            raise
+        finally:
+            profile_path = self.stop_profiler(profiler, stage_name)
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start + children_cpu_seconds() - children_cpu_before
+            rss_after = current_rss_bytes()
+            peak_after = peak_rss_bytes()
+            record = {
+                'stage': stage_name,
+                'status': status,
+                'wall_s': wall,
+                'cpu_s': cpu,
+                # Поточна пам'ять після етапу і її зміна: етап може звільнити пам'ять (від'ємна зміна)
+                'rss_bytes': rss_after,
+                'rss_delta_bytes': rss_after - rss_before if rss_after is not None else None,
+                # Піковий обсяг процесу лише зростає: приріст ненульовий, коли етап встановив новий максимум
+                'peak_rss_bytes': peak_after,
+                'peak_rss_increase_bytes': peak_after - peak_before if peak_after is not None else None,
+                'children_peak_rss_bytes': children_peak_rss_bytes(),
+                'in': counts_in,
+                'out': self.measure(builder),
+                'profile': profile_path,
+            }
+            self.stages.append(record)
+            logger.info("%s: %s in %.3f s (cpu %.3f s), rows %d -> %d", stage_name, status, wall, cpu,
+                        counts_in['rows'], record['out']['rows'])
+
+    def report(self):
+        return {
+            'started_at': self.started_at,
+            'python': sys.version.split()[0],
+            'total_wall_s': sum(record['wall_s'] for record in self.stages),
+            'total_cpu_s': sum(record['cpu_s'] for record in self.stages),
+            'stages': self.stages,
+        }
+
+    def write_report(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, ensure_ascii=False, indent=2)
+
+
+# Етапи GeoDataManager.construct по порядку: (метод SubbasinBuilder, аргументи)
+PIPELINE_STAGES = [
+    # ('build_river_hierarchy', {}),
+    ('check_and_change_crs', {}),
+    ('initialize_and_set_column_types', {}),
+    # ('geometry_buffer_subbasins', {'buffer_size': -1}),
+    ('geometry_buffer_riv1', {'buffer_size': 25}),
+    ('analyze_river_intersections', {}),
+    ('update_subbasins_with_main_river', {}),
+    ('optimize_geometry', {'buffer_size': -300, 'simplify_tolerance': 20}),
+    ('fragment_subbasins_by_unique_id', {}),
+    ('compare_and_update_river_names', {}),
+    # ('add_hierarchy_columns', {}),
+    ('remove_main_river_column', {}),
+    ('restore_original_geometry', {}),
+    ('remove_and_merge_intersections', {}),
+    ('save_subbasains_new', {'output_format': 'geojson'}),
+]
 
 
 class GeoDataManager:
-    def __init__(self, builder: SubbasinBuilder):
+    # Етапи, яким потрібен riv1 (після буферизації), для збереження його в контрольних точках
+    RIV1_STAGES = ('geometry_buffer_riv1', 'analyze_river_intersections')
+
+    def __init__(self, builder: SubbasinBuilder, instrumentation=None, report_path=None, checkpoint_dir=None,
+                 state_dir=None, stage_options=None):
         self.builder = builder
+        # stage_options доповнюють аргументи етапів з PIPELINE_STAGES: {етап: {аргумент: значення}}
+        stage_options = stage_options or {}
+        unknown = set(stage_options) - set(self.stage_names())
+        if unknown:
+            raise ValueError(f"Unknown pipeline stages in stage_options: {sorted(unknown)}")
+        self.stages = [(stage_name, {**stage_kwargs, **stage_options.get(stage_name, {})})
+                       for stage_name, stage_kwargs in PIPELINE_STAGES]
+        self.instrumentation = instrumentation or PipelineInstrumentation()
+        self.report_path = report_path
+        # checkpoint_dir вмикає збереження стану після кожного етапу
+        self.checkpoint_dir = checkpoint_dir
+        # state_dir - стан повного запуску, від якого рахується construct_incremental
+        self.state_dir = state_dir
+
+    @staticmethod
+    def stage_names():
+        return [stage_name for stage_name, _ in PIPELINE_STAGES]
+
+    def checkpoint_path(self, stage_name):
+        position = self.stage_names().index(stage_name)
+        return os.path.join(self.checkpoint_dir, f"{position:02d}_{stage_name}")
+
+    def select_stages(self, start_at=None, stop_after=None, only=None):
+        names = self.stage_names()
+        for stage_name in [start_at, stop_after, *(only or [])]:
+            if stage_name is not None and stage_name not in names:
+                raise ValueError(f"Unknown pipeline stage: {stage_name!r}")
+        first = names.index(start_at) if start_at else 0
+        last = names.index(stop_after) if stop_after else len(names) - 1
+        return [stage for stage in self.stages[first:last + 1] if only is None or stage[0] in only]
+
+    def restore_before(self, stage_name):
+        # Відновлення стану з контрольної точки етапу, що передує stage_name
+        position = self.stage_names().index(stage_name)
+        if position == 0:
+            return
+        if not self.checkpoint_dir:
+            raise ValueError("checkpoint_dir is required to resume from a stage")
+        previous_stage = self.stage_names()[position - 1]
+        directory = self.checkpoint_path(previous_stage)
+        if not os.path.exists(os.path.join(directory, 'state.json')):
+            raise FileNotFoundError(f"No checkpoint for stage {previous_stage!r} in {self.checkpoint_dir}")
+        self.builder.load_state(directory)
+        logger.info("Resumed from checkpoint %s", directory)
+
+    def construct(self, start_at=None, stop_after=None, only=None):
+        stages = self.select_stages(start_at, stop_after, only)
+        if stages and stages[0][0] != PIPELINE_STAGES[0][0]:
+            self.restore_before(stages[0][0])
+
+        names = self.stage_names()
+        for stage_name, stage_kwargs in stages:
+            with self.instrumentation.stage(stage_name, self.builder):
+                getattr(self.builder, stage_name)(**stage_kwargs)
+            if self.checkpoint_dir:
+                # riv1 зберігається, якщо він потрібен будь-якому наступному етапу конвеєра, а не лише вибраним:
+                # з контрольної точки можна продовжити з будь-якого етапу
+                remaining = names[names.index(stage_name) + 1:]
+                self.builder.save_state(self.checkpoint_path(stage_name),
+                                        include_riv1=any(name in self.RIV1_STAGES for name in remaining))
+
+        # Стан для інкрементного режиму зберігається лише після повного запуску в пам'яті:
+        # хеші об'єктів потребують повних шарів
+        if self.state_dir and stages == self.stages and not self.builder.tile_size:
+            with self.instrumentation.stage('save_run_state', self.builder):
+                self.builder.save_run_state(self.state_dir, self.stages)
+
+        if self.report_path:
+            self.instrumentation.write_report(self.report_path)
+        return self.instrumentation.report()
+
+    def construct_incremental(self):
+        # Оновлення попереднього результату лише для змінених об'єктів; без стану - повний запуск
+        if not self.state_dir or not os.path.exists(os.path.join(self.state_dir, 'state.json')):
+            logger.info("No run state found, running the full pipeline")
+            return self.construct()
+        if self.builder.tile_size:
+            logger.info("Incremental mode needs in-memory layers, running the full tiled pipeline")
+            return self.construct()
+
+        with self.instrumentation.stage('update_incrementally', self.builder):
+            updated = self.builder.update_incrementally(self.state_dir, self.stages)
+        if not updated:
+            return self.construct()
+
+        stage_kwargs = dict(self.stages)
+        if 'save_subbasains_new' in stage_kwargs:
+            with self.instrumentation.stage('save_subbasains_new', self.builder):
+                self.builder.save_subbasains_new(**stage_kwargs['save_subbasains_new'])
+        with self.instrumentation.stage('save_run_state', self.builder):
+            self.builder.save_run_state(self.state_dir, self.stages)
+
+        if self.report_path:
+            self.instrumentation.write_report(self.report_path)
+        return self.instrumentation.report()
+
+
+@dataclass
+class PipelineConfig:
+    # Шляхи і параметри одного запуску; JSON-файл з тими ж ключами читається PipelineConfig.load
+    subbasins_path: str = SUBBASINS_PATH
+    rivers_path: str = RIVERS_PATH
+    rivers_new_path: str = RIVERS_NEW_PATH
+    riv1_path: str = RIV1_PATH
+    output_dir: str = OUTPUT_DIR
+    output_format: str = 'geojson'
+    # None - ім'я з часом запису в output_dir
+    output_path: str = None
+    # Аргументи SubbasinBuilder (clip_to_subbasins, cache_dir, workers, tile_size, ...)
+    builder_options: dict = field(default_factory=dict)
+    # Аргументи етапів поверх PIPELINE_STAGES
+    stage_options: dict = field(default_factory=dict)
+    checkpoint_dir: str = None
+    # Стан для інкрементного режиму зберігається лише за явно заданим каталогом
+    state_dir: str = None
+    report_path: str = None
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as file:
+            options = json.load(file)
+        unknown = set(options) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError(f"Unknown configuration keys in {path}: {sorted(unknown)}")
+        return cls(**options)
+
+    def replace(self, **changes):
+        return replace(self, **changes)
+
+    def create_builder(self):
+        return SubbasinBuilder(subbasins_path=self.subbasins_path, rivers_path=self.rivers_path,
+                               rivers_new_path=self.rivers_new_path, riv1_path=self.riv1_path, **self.builder_options)
+
+    def create_manager(self, builder=None, instrumentation=None):
+        save_options = {'output_format': self.output_format, 'path': self.output_path, 'directory': self.output_dir}
+        stage_options = dict(self.stage_options)
+        stage_options['save_subbasains_new'] = {**save_options, **stage_options.get('save_subbasains_new', {})}
+        return GeoDataManager(builder or self.create_builder(), instrumentation=instrumentation,
+                              report_path=self.report_path, checkpoint_dir=self.checkpoint_dir,
+                              state_dir=self.state_dir, stage_options=stage_options)
+
+
+def run_pipeline(config=None, incremental=False, **construct_options):
+    # Точка входу для планувальника: повний (або інкрементний) запуск за конфігурацією
+    manager = (config or PipelineConfig()).create_manager()
+    if incremental:
+        return manager.construct_incremental()
+    return manager.construct(**construct_options)
+
+
+class SubsetIndex:
+    # Просторовий індекс повного шару, обмежений вибіркою його рядків: query повертає позиції у вибірці,
+    # як sindex самої вибірки, без побудови нового дерева
+    def __init__(self, sindex, positions, size):
+        self.sindex = sindex
+        self.lookup = np.full(size, -1, dtype=np.int64)
+        self.lookup[positions] = np.arange(len(positions))
+
+    def query(self, geometry, predicate=None, **kwargs):
+        input_idx, tree_idx = self.sindex.query(geometry, predicate=predicate, **kwargs)
+        subset_idx = self.lookup[tree_idx]
+        selected = subset_idx >= 0
+        return np.vstack([input_idx[selected], subset_idx[selected]])
+
+
+class SharedLayers:
+    # Шари річок і riv1, прочитані один раз разом із просторовими індексами, для кількох файлів суббасейнів.
+    # Кожен запуск отримує свою вибірку в межах охоплення суббасейнів - як при читанні з bbox;
+    # назви інтерновані один раз у спільній таблиці, а дерево річок спільне для всіх запусків.
+
+    def __init__(self, rivers_path=RIVERS_PATH, rivers_new_path=RIVERS_NEW_PATH, riv1_path=RIV1_PATH):
+        self.names = RiverNameTable()
+        self.rivers = intern_layer_columns(self.names, read_layer(rivers_path, columns=RIVERS_COLUMNS), RIVERS_COLUMNS)
+        self.riv1 = read_layer(riv1_path, columns=RIV1_COLUMNS)
+        # rivers_new читається при першому зверненні: типовий конвеєр його не використовує
+        self.rivers_new_path = rivers_new_path
+        self._rivers_new = None
+        self._lock = threading.Lock()
+        # Індекси будуються до запуску потоків
+        for layer in (self.rivers, self.riv1):
+            layer.sindex
+
+    @property
+    def rivers_new(self):
+        with self._lock:
+            if self._rivers_new is None:
+                self._rivers_new = intern_layer_columns(
+                    self.names, read_layer(self.rivers_new_path, columns=RIVERS_NEW_COLUMNS), RIVERS_NEW_COLUMNS)
+        return self._rivers_new
 
-    def construct(self):
-        # self.builder.build_river_hierarchy()
-        self.builder.check_and_change_crs()
-        self.builder.initialize_and_set_column_types()
-        # self.builder.geometry_buffer_subbasins(buffer_size=-1)
-        self.builder.geometry_buffer_riv1(buffer_size=25)
-        self.builder.analyze_river_intersections()
-        self.builder.update_subbasins_with_main_river()
-        self.builder.optimize_geometry(buffer_size=-300, simplify_tolerance=20)
-        self.builder.fragment_subbasins_by_unique_id()
-        self.builder.compare_and_update_river_names()
-        # self.builder.add_hierarchy_columns()
-        self.builder.remove_main_river_column()
-        self.builder.restore_original_geometry()
-        # self.builder.remove_and_merge_intersections()
-        self.builder.save_subbasains_new()
+    @staticmethod
+    def clip_positions(layer, builder):
+        # Позиції об'єктів у межах охоплення суббасейнів; None - без обрізання
+        bbox = builder.layer_bbox(layer.crs)
+        if bbox is None:
+            return None
+        return np.sort(layer.sindex.query(shapely.box(*bbox), predicate='intersects'))
+
+    def attach(self, builder):
+        builder.names = self.names
+        builder.shared_layers = self
+        positions = self.clip_positions(self.rivers, builder)
+        if positions is None:
+            # Річки не змінюються під час запуску, тож шар передається без копіювання
+            builder.rivers = self.rivers
+        else:
+            builder.rivers = self.rivers.iloc[positions].reset_index(drop=True)
+            builder.rivers_sindex = SubsetIndex(self.rivers.sindex, positions, len(self.rivers))
+        positions = self.clip_positions(self.riv1, builder)
+        # riv1 копіюється завжди: буферизація змінює його на місці
+        builder.riv1 = self.riv1.copy() if positions is None else self.riv1.iloc[positions].reset_index(drop=True)
+
+
+def batch_job_config(config, subbasins_path):
+    # Вихідні файли, контрольні точки і стан кожного файлу суббасейнів - під його ім'ям
+    name = os.path.splitext(os.path.basename(subbasins_path))[0]
+    extension = OUTPUT_WRITERS[config.output_format].extension
+    return config.replace(
+        subbasins_path=subbasins_path,
+        output_path=os.path.join(config.output_dir, name + extension),
+        checkpoint_dir=os.path.join(config.checkpoint_dir, name) if config.checkpoint_dir else None,
+        state_dir=os.path.join(config.state_dir, name) if config.state_dir else None,
+        report_path=os.path.join(os.path.dirname(config.report_path), f"{name}_{os.path.basename(config.report_path)}")
+        if config.report_path else None,
+    )
+
+
+def run_batch(config, subbasins_paths, threads=4, incremental=False):
+    # Шари річок читаються один раз; файли суббасейнів обробляються паралельно в потоках
+    # (операції shapely відпускають GIL). Повертає {шлях: звіт або виняток}.
+    if config.builder_options.get('tile_size'):
+        raise ValueError("Batch mode shares in-memory river layers and does not support tile_size")
+    shared = SharedLayers(config.rivers_path, config.rivers_new_path, config.riv1_path)
+    jobs = [batch_job_config(config, subbasins_path) for subbasins_path in subbasins_paths]
+    names = [os.path.basename(job.output_path) for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Subbasin files in one batch must have distinct names")
+
+    def run_job(job):
+        builder = job.create_builder()
+        shared.attach(builder)
+        manager = job.create_manager(builder)
+        return manager.construct_incremental() if incremental else manager.construct()
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = {job.subbasins_path: executor.submit(run_job, job) for job in jobs}
+        for subbasins_path, future in futures.items():
+            try:
+                results[subbasins_path] = future.result()
+                logger.info("Finished %s", subbasins_path)
+            except Exception as error:
+                logger.exception("Failed %s", subbasins_path)
+                results[subbasins_path] = error
+    return results
+
+
+def main(argv=None):
+    stage_names = GeoDataManager.stage_names()
+    parser = argparse.ArgumentParser(description="Найменування суббасейнів за головною річкою")
+    parser.add_argument('--config', default=None, help="JSON з полями PipelineConfig; аргументи нижче мають пріоритет")
+    parser.add_argument('--subbasins', default=None)
+    parser.add_argument('--rivers', default=None)
+    parser.add_argument('--rivers-new', default=None)
+    parser.add_argument('--riv1', default=None)
+    parser.add_argument('--output-dir', default=None)
+    parser.add_argument('--output-format', choices=list(OUTPUT_WRITERS), default=None)
+    parser.add_argument('--checkpoint-dir', default=None,
+                        help="Каталог для збереження стану після кожного етапу")
+    parser.add_argument('--start-at', choices=stage_names, metavar='STAGE', default=None,
+                        help="Відновити з контрольної точки попереднього етапу")
+    parser.add_argument('--stop-after', choices=stage_names, metavar='STAGE', default=None)
+    parser.add_argument('--only', choices=stage_names, metavar='STAGE', nargs='+', default=None)
+    parser.add_argument('--state-dir', default=None,
+                        help=f"Зберігати стан повного запуску для інкрементного режиму "
+                             f"(для --incremental за замовчуванням {RUN_STATE_DIR})")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Перерахувати лише змінені суббасейни та річки відносно --state-dir")
+    parser.add_argument('--tile-size', type=float, default=None,
+                        help=f"Позаядерний режим: розмір плитки riv1 у метрах (наприклад, {TILE_SIZE})")
+    parser.add_argument('--spill-dir', default=None,
+                        help="Каталог для тимчасових результатів плиток")
+    parser.add_argument('--batch', nargs='+', metavar='SUBBASINS', default=None,
+                        help="Кілька файлів суббасейнів зі спільними шарами річок, прочитаними один раз")
+    parser.add_argument('--threads', type=int, default=4, help="Кількість одночасних запусків у --batch")
+    args = parser.parse_args(argv)
+
+    config = PipelineConfig.load(args.config) if args.config else PipelineConfig()
+    overrides = {
+        'subbasins_path': args.subbasins,
+        'rivers_path': args.rivers,
+        'rivers_new_path': args.rivers_new,
+        'riv1_path': args.riv1,
+        'output_dir': args.output_dir,
+        'output_format': args.output_format,
+        'checkpoint_dir': args.checkpoint_dir,
+        'state_dir': args.state_dir,
+    }
+    config = config.replace(**{key: value for key, value in overrides.items() if value is not None})
+    if args.incremental and not config.state_dir:
+        config = config.replace(state_dir=RUN_STATE_DIR)
+    builder_overrides = {'tile_size': args.tile_size, 'spill_dir': args.spill_dir}
+    config.builder_options = {**config.builder_options,
+                              **{key: value for key, value in builder_overrides.items() if value is not None}}
+
+    if args.batch:
+        results = run_batch(config, args.batch, threads=args.threads, incremental=args.incremental)
+        return 1 if any(isinstance(result, Exception) for result in results.values()) else 0
+
+    manager = config.create_manager()
+    if args.incremental:
+        manager.construct_incremental()
+    else:
+        manager.construct(start_at=args.start_at, stop_after=args.stop_after, only=args.only)
+    return 0
 
 
 # Client code
-builder = SubbasinBuilder()
-manager = GeoDataManager(builder)
-manager.construct()
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import argparse
+import json
+import logging
+import os
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import geopandas as gpd
+import numpy as np
+import pyproj
+import shapely
+
+from naming_subb import OUTPUT_CRS, read_layer
+
+logger = logging.getLogger(__name__)
+
+
+# Колонки результату запиту: ідентифікатор, назва, фрагмент і ланцюжок стоку FlowTo, FlowTo2, ...
+LOOKUP_COLUMNS = ['Subbasin', 'Name_UA', 'Fragment']
+_FLOW_TO_PATTERN = re.compile(r'^FlowTo(\d*)$')
+# Файли збереженого індексу
+INDEX_GEOMETRY_FILE = 'subbasins.parquet'
+INDEX_METADATA_FILE = 'index.json'
+INDEX_VERSION = 1
+LOOKUP_HOST = '127.0.0.1'
+LOOKUP_PORT = 8765
+# Обмеження розміру тіла POST-запиту
+LOOKUP_MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+def flow_to_columns(columns):
+    matches = [(column, _FLOW_TO_PATTERN.match(column)) for column in columns]
+    return [column for column, match in sorted((item for item in matches if item[1]),
+                                                key=lambda item: int(item[1].group(1) or 1))]
+
+
+class SubbasinIndex:
+    # Іменовані суббасейни в упакованому STRtree з підготовленими полігонами для пакетних запитів.
+    # Точки перевіряються intersects_xy по кандидатах з дерева, без створення об'єктів Point.
+
+    def __init__(self, subbasins):
+        columns = [column for column in LOOKUP_COLUMNS if column in subbasins.columns]
+        columns += flow_to_columns(subbasins.columns)
+        self.crs = subbasins.crs
+        self.attributes = subbasins[columns].reset_index(drop=True)
+        # Цілі колонки з підтримкою NA, щоб промахи не перетворювали їх на float
+        for column in ('Subbasin', 'Fragment'):
+            if column in self.attributes:
+                self.attributes[column] = self.attributes[column].astype('Int64')
+        self.geometries = np.asarray(subbasins.geometry.values, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        self._transformers = {}
+
+    @classmethod
+    def from_file(cls, path):
+        # Вихідний файл конвеєра (GeoJSON/FlatGeobuf/GeoParquet) або каталог збереженого індексу
+        if os.path.isdir(path):
+            return cls.load(path)
+        if path.endswith('.parquet'):
+            return cls(gpd.read_parquet(path))
+        return cls(read_layer(path))
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def transformer(self, crs):
+        # Перетворення координат запиту в CRS індексу; None, якщо CRS збігаються
+        if crs is None or self.crs is None:
+            return None
+        crs = pyproj.CRS.from_user_input(crs)
+        if crs == self.crs:
+            return None
+        key = crs.to_wkt()
+        if key not in self._transformers:
+            self._transformers[key] = pyproj.Transformer.from_crs(crs, self.crs, always_xy=True)
+        return self._transformers[key]
+
+    def lookup_points(self, x, y, crs=OUTPUT_CRS):
+        # Один суббасейн на точку (перший за порядком шару для точок на спільній межі); порожній рядок - промах
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        transformer = self.transformer(crs)
+        if transformer is not None:
+            x, y = transformer.transform(x, y)
+        query_idx, tree_idx = self.tree.query(shapely.points(x, y))
+        hits = shapely.intersects_xy(self.geometries[tree_idx], x[query_idx], y[query_idx])
+        query_idx, tree_idx = query_idx[hits], tree_idx[hits]
+        order = np.lexsort((tree_idx, query_idx))
+        query_idx, first = np.unique(query_idx[order], return_index=True)
+        positions = np.full(len(x), -1, dtype=np.int64)
+        positions[query_idx] = tree_idx[order][first]
+        # Позиція -1 відсутня в індексі атрибутів і дає рядок з NA
+        return self.attributes.reindex(positions).reset_index(drop=True)
+
+    def lookup(self, geometries, predicate='intersects', crs=OUTPUT_CRS):
+        # Усі суббасейни, що задовольняють predicate з кожною геометрією (лінії, полігони), як sjoin
+        geometries = gpd.GeoSeries(np.asarray(geometries, dtype=object), crs=crs)
+        if self.crs is not None and geometries.crs is not None and geometries.crs != self.crs:
+            geometries = geometries.to_crs(self.crs)
+        query_idx, tree_idx = self.tree.query(geometries.values, predicate=predicate)
+        order = np.lexsort((tree_idx, query_idx))
+        result = self.attributes.iloc[tree_idx[order]].reset_index(drop=True)
+        result.insert(0, 'query', query_idx[order])
+        return result
+
+    def save(self, directory):
+        # Атрибути і геометрії у GeoParquet у порядку індексу; дерево перебудовується при завантаженні
+        os.makedirs(directory, exist_ok=True)
+        frame = gpd.GeoDataFrame(self.attributes, geometry=self.geometries, crs=self.crs)
+        frame.to_parquet(os.path.join(directory, INDEX_GEOMETRY_FILE))
+        with open(os.path.join(directory, INDEX_METADATA_FILE), 'w', encoding='utf-8') as file:
+            json.dump({'version': INDEX_VERSION, 'subbasins': len(self), 'columns': list(self.attributes.columns)},
+                      file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, INDEX_METADATA_FILE), encoding='utf-8') as file:
+            metadata = json.load(file)
+        if metadata['version'] != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version {metadata['version']} in {directory}")
+        return cls(gpd.read_parquet(os.path.join(directory, INDEX_GEOMETRY_FILE)))
+
+
+def records(frame):
+    # JSON-сумісні записи: NaN/NA -> null
+    return json.loads(frame.to_json(orient='records', force_ascii=False))
+
+
+class LookupHandler(BaseHTTPRequestHandler):
+    # GET /lookup?x=..&y=..[&crs=..] - точки (x і y можна повторювати);
+    # POST /lookup {"points": [[x, y], ...]} або {"geometries": [GeoJSON або WKT, ...], "predicate": ...}
+    index = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            return self.send_json({'status': 'ok', 'subbasins': len(self.index)})
+        if url.path != '/lookup':
+            return self.send_json({'error': f"Unknown path {url.path}"}, status=404)
+        query = parse_qs(url.query)
+        try:
+            x = [float(value) for value in query.get('x', [])]
+            y = [float(value) for value in query.get('y', [])]
+        except ValueError as error:
+            return self.send_json({'error': str(error)}, status=400)
+        if len(x) != len(y):
+            return self.send_json({'error': "x and y must have the same length"}, status=400)
+        crs = query.get('crs', [OUTPUT_CRS])[0]
+        self.send_json({'results': records(self.index.lookup_points(x, y, crs=crs))})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/lookup':
+            return self.send_json({'error': f"Unknown path {self.path}"}, status=404)
+        length = int(self.headers.get('Content-Length', 0))
+        if length > LOOKUP_MAX_BODY_BYTES:
+            return self.send_json({'error': "Request body is too large"}, status=413)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                return self.send_json({'error': "Expected a JSON object"}, status=400)
+            crs = request.get('crs', OUTPUT_CRS)
+            if 'points' in request:
+                points = np.asarray(request['points'], dtype=float).reshape(-1, 2)
+                results = self.index.lookup_points(points[:, 0], points[:, 1], crs=crs)
+            elif 'geometries' in request:
+                geometries = [shapely.from_wkt(geometry) if isinstance(geometry, str)
+                              else shapely.geometry.shape(geometry) for geometry in request['geometries']]
+                results = self.index.lookup(geometries, predicate=request.get('predicate', 'intersects'), crs=crs)
+            else:
+                return self.send_json({'error': "Expected 'points' or 'geometries'"}, status=400)
+        except (ValueError, TypeError, KeyError, shapely.errors.ShapelyError, pyproj.exceptions.CRSError) as error:
+            return self.send_json({'error': str(error)}, status=400)
+        self.send_json({'results': records(results)})
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def make_server(index, host=LOOKUP_HOST, port=LOOKUP_PORT):
+    handler = type('SubbasinLookupHandler', (LookupHandler,), {'index': index})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пошук суббасейну за точкою або геометрією")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Зберегти індекс вихідного файлу для швидкого перезапуску")
+    build.add_argument('source', help="Вихідний файл конвеєра")
+    build.add_argument('index_dir')
+    serve = commands.add_parser('serve', help="Локальний HTTP-сервіс")
+    serve.add_argument('source', help="Каталог індексу або вихідний файл конвеєра")
+    serve.add_argument('--host', default=LOOKUP_HOST)
+    serve.add_argument('--port', type=int, default=LOOKUP_PORT)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    index = SubbasinIndex.from_file(args.source)
+    logger.info("Loaded %d subbasins from %s in %.3f s", len(index), args.source, time.perf_counter() - start)
+    if args.command == 'build':
+        index.save(args.index_dir)
+        logger.info("Saved index to %s", args.index_dir)
+        return 0
+
+    server = make_server(index, args.host, args.port)
+    logger.info("Serving subbasin lookups on http://%s:%d", args.host, server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    raise SystemExit(main())
@@ -0,0 +1,166 @@
+import heapq
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from naming_subb import OUTPUT_CRS, SEAS, normalize_apostrophes
+
+
+# Синтетичні вхідні дані конвеєра: деревоподібна мережа стоку на сітці суббасейнів.
+# Кожна клітинка - суббасейн, її riv1 - відрізок від центру до середини шляху до нижньої клітинки,
+# річки - ланцюжки клітинок від витоку до гирла з найбільшою площею водозбору на злиттях.
+WORKING_CRS = "EPSG:32636"
+CELL_SIZE = 5000
+ORIGIN = (200000.0, 5000000.0)
+# Зсув вузлів сітки (частка клітинки), щоб суббасейни були неправильними чотирикутниками
+NODE_JITTER = 0.2
+# Кількість суббасейнів на одне гирло, що впадає в море
+SUBBASINS_PER_OUTLET = 2000
+# Частка одноклітинних річок без назви
+UNNAMED_SHARE = 0.1
+# Основи назв з апострофами і назвами без префікса "р. ", як у реальних шарах
+NAME_STEMS = ("Рокитна", "Кам'янка", "Вільшанка", "Дев'ятка", "Гнилоп'ять", "Тетерів", "Сугаклея",
+              "Магістральний канал", "Рукав", "Ворскла", "Лозова", "Солона")
+UNNAMED = "Без назви"
+
+
+def drainage_tree(rows, cols, count, outlets, rng):
+    # Випадкове кістякове дерево сітки (алгоритм Прима від гирл): down - нижня клітинка, -1 для гирл.
+    # order - порядок приєднання, кожна клітинка йде після своєї нижньої.
+    down = np.full(count, -1, dtype=np.int64)
+    visited = np.zeros(count, dtype=bool)
+    keys = rng.random(count)
+    order = []
+    heap = [(keys[cell], cell, -1) for cell in outlets]
+    heapq.heapify(heap)
+    while heap:
+        _, cell, parent = heapq.heappop(heap)
+        if visited[cell]:
+            continue
+        visited[cell] = True
+        down[cell] = parent
+        order.append(cell)
+        x, y = cell % cols, cell // cols
+        neighbours = []
+        if x > 0:
+            neighbours.append(cell - 1)
+        if x < cols - 1 and cell + 1 < count:
+            neighbours.append(cell + 1)
+        if y > 0:
+            neighbours.append(cell - cols)
+        if cell + cols < count:
+            neighbours.append(cell + cols)
+        for neighbour in neighbours:
+            if not visited[neighbour]:
+                heapq.heappush(heap, (keys[neighbour], neighbour, cell))
+    return down, np.asarray(order, dtype=np.int64)
+
+
+def assign_rivers(down, order):
+    # Річка продовжується вгору в притоку з найбільшою площею водозбору, решта приток - нові річки
+    count = len(down)
+    area = np.ones(count, dtype=np.int64)
+    for cell in order[::-1]:
+        if down[cell] >= 0:
+            area[down[cell]] += area[cell]
+
+    tributaries = np.flatnonzero(down >= 0)
+    confluences = pd.DataFrame({'cell': tributaries, 'down': down[tributaries], 'area': area[tributaries]})
+    main = (confluences.sort_values(['area', 'cell'], ascending=[False, True])
+            .drop_duplicates('down')['cell'].to_numpy())
+    continues = np.zeros(count, dtype=bool)
+    continues[main] = True
+
+    river = np.full(count, -1, dtype=np.int64)
+    rivers = 0
+    for cell in order:
+        if continues[cell]:
+            river[cell] = river[down[cell]]
+        else:
+            river[cell] = rivers
+            rivers += 1
+    return river, rivers
+
+
+def river_names(river, rivers, rng):
+    names = np.array([f"{NAME_STEMS[number % len(NAME_STEMS)]} {number}" for number in range(rivers)], dtype=object)
+    single_cell = np.bincount(river, minlength=rivers) == 1
+    names[single_cell & (rng.random(rivers) < UNNAMED_SHARE)] = UNNAMED
+    return names
+
+
+def generate_layers(subbasins, cell_size=CELL_SIZE, seed=0, origin=ORIGIN, crs=WORKING_CRS):
+    # Повертає (subbasins, rivers, rivers_new, riv1) з тими ж колонками, що й реальні шари
+    rng = np.random.default_rng(seed)
+    cols = int(np.ceil(np.sqrt(subbasins)))
+    rows = int(np.ceil(subbasins / cols))
+    cells = np.arange(subbasins)
+    ix, iy = cells % cols, cells // cols
+
+    # Вузли сітки зі зсувом; сусідні суббасейни мають спільні межі
+    node_x, node_y = np.meshgrid(np.arange(cols + 1, dtype=float), np.arange(rows + 1, dtype=float))
+    node_x += rng.uniform(-NODE_JITTER, NODE_JITTER, node_x.shape)
+    node_y += rng.uniform(-NODE_JITTER, NODE_JITTER, node_y.shape)
+    node_x = origin[0] + node_x * cell_size
+    node_y = origin[1] + node_y * cell_size
+    corners = [(iy, ix), (iy, ix + 1), (iy + 1, ix + 1), (iy + 1, ix), (iy, ix)]
+    rings = np.stack([np.column_stack([node_x[row, col], node_y[row, col]]) for row, col in corners], axis=1)
+    polygons = shapely.polygons(rings)
+    centers = rings[:, :4].mean(axis=1)
+
+    outlets = rng.choice(cols, size=max(1, min(cols, subbasins // SUBBASINS_PER_OUTLET)), replace=False)
+    down, order = drainage_tree(rows, cols, subbasins, outlets, rng)
+    river, rivers = assign_rivers(down, order)
+    names = river_names(river, rivers, rng)
+
+    # Гирло клітинки: центр нижньої клітинки або точка за південною межею для гирл у море
+    mouths = centers[np.maximum(down, 0)]
+    at_sea = down < 0
+    mouths[at_sea] = centers[at_sea] - [0, cell_size]
+
+    # Лінії річок від витоку (пізніше приєднані клітинки) до гирла
+    position = np.empty(subbasins, dtype=np.int64)
+    position[order] = np.arange(subbasins)
+    path = np.lexsort((-position[cells], river))
+    river_end = pd.Series(path).groupby(river[path]).last().to_numpy()
+    coords = np.vstack([centers[path], mouths[river_end]])
+    indices = np.concatenate([river[path], np.arange(rivers)])
+    line_order = np.argsort(indices, kind='stable')
+    lines = shapely.linestrings(coords[line_order], indices=indices[line_order])
+
+    flow_to = np.where(down[river_end] >= 0, names[river[np.maximum(down[river_end], 0)]],
+                       np.asarray(SEAS, dtype=object)[np.arange(rivers) % len(SEAS)])
+    rivers_layer = gpd.GeoDataFrame({'name_ua': names}, geometry=lines, crs=crs)
+    rivers_new_layer = gpd.GeoDataFrame({
+        'NAME_UKR': [normalize_apostrophes(name) for name in names],
+        'FLOW_TO': [normalize_apostrophes(name) for name in flow_to],
+    }, geometry=lines, crs=crs)
+
+    reaches = shapely.linestrings(np.stack([centers, (centers + mouths) / 2], axis=1))
+    riv1_layer = gpd.GeoDataFrame({'Subbasin': cells + 1}, geometry=reaches, crs=crs)
+    subbasins_layer = gpd.GeoDataFrame({'Subbasin': cells + 1}, geometry=polygons, crs=crs).to_crs(OUTPUT_CRS)
+    return subbasins_layer, rivers_layer, rivers_new_layer, riv1_layer
+
+
+def layer_paths(directory):
+    # Аргументи шляхів для SubbasinBuilder
+    return {
+        'subbasins_path': os.path.join(directory, 'subbasins.geojson'),
+        'rivers_path': os.path.join(directory, 'rivers.shp'),
+        'rivers_new_path': os.path.join(directory, 'rivers_new.shp'),
+        'riv1_path': os.path.join(directory, 'riv1.shp'),
+    }
+
+
+def write_layers(directory, subbasins, **options):
+    # Файли у форматах реальних даних
+    os.makedirs(directory, exist_ok=True)
+    subbasins_layer, rivers_layer, rivers_new_layer, riv1_layer = generate_layers(subbasins, **options)
+    paths = layer_paths(directory)
+    layers = (subbasins_layer, rivers_layer, rivers_new_layer, riv1_layer)
+    for layer, path in zip(layers, paths.values()):
+        layer.to_file(path, encoding='UTF-8')
+    return paths
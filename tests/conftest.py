@@ -0,0 +1,36 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic_hydrography  # noqa: E402
+from naming_subb import GeoDataManager, SubbasinBuilder, read_layer  # noqa: E402
+
+
+SYNTHETIC_SUBBASINS = 1000
+
+
+@pytest.fixture(scope='session')
+def synthetic_regions(tmp_path_factory):
+    # Синтетичні шари і два файли суббасейнів (західна і східна половини) зі спільними шарами річок
+    directory = str(tmp_path_factory.mktemp('synthetic'))
+    paths = synthetic_hydrography.write_layers(directory, SYNTHETIC_SUBBASINS, seed=0)
+    subbasins = read_layer(paths['subbasins_path'])
+    centers = subbasins.geometry.centroid.x.to_numpy()
+    west = centers < np.median(centers)
+    regions = {}
+    for region, rows in (('west', west), ('east', ~west)):
+        subbasins_path = os.path.join(directory, f'{region}.geojson')
+        subbasins[rows].to_file(subbasins_path, encoding='UTF-8')
+        regions[region] = {**paths, 'subbasins_path': subbasins_path}
+    return regions
+
+
+def name_subbasins(paths, stop_after='compare_and_update_river_names', **builder_options):
+    # Етапи конвеєра до найменування суббасейнів; повертає шар суббасейнів
+    builder = SubbasinBuilder(**paths, **builder_options)
+    GeoDataManager(builder).construct(stop_after=stop_after)
+    return builder.subbasins
@@ -0,0 +1,41 @@
+import copy
+import os
+
+import pandas as pd
+import pytest
+
+import benchmarks
+from naming_subb import SubbasinBuilder, decode_categories
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBBASINS_PATH = os.path.join(ROOT, benchmarks.SMALL_SUBBASINS_PATH)
+INTERSECTIONS_CSV = os.path.join(ROOT, benchmarks.MAX_INTERSECTIONS_CSV)
+
+
+@pytest.mark.skipif(not os.path.exists(SUBBASINS_PATH), reason="Small_subs_100km2_cut.geojson is not available")
+def test_vectorized_attribute_stages_match_reference():
+    builder = SubbasinBuilder(subbasins_path=SUBBASINS_PATH, cache_dir=None)
+    builder.initialize_and_set_column_types()
+    intersections = pd.read_csv(INTERSECTIONS_CSV)
+    builder.max_intersections_dict = dict(zip(intersections['Subbasin'], intersections['MainRiver']))
+    builder.hierarchy = benchmarks.sample_hierarchy(builder.max_intersections_dict.values())
+    reference = copy.copy(builder)
+    reference.subbasins = decode_categories(builder.subbasins)
+
+    # Порядкові реалізації до векторизації проти поточних етапів
+    benchmarks.reference_update_subbasins_with_main_river(reference)
+    benchmarks.reference_compare_and_update_river_names(reference)
+    benchmarks.reference_add_hierarchy_columns(reference)
+    builder.update_subbasins_with_main_river()
+    builder.compare_and_update_river_names()
+    builder.add_hierarchy_columns()
+
+    expected = decode_categories(reference.subbasins)
+    result = decode_categories(builder.subbasins)
+    assert result['Name_UA'].notna().any()
+    flow_to_columns = [column for column in expected.columns if column.startswith('FlowTo')]
+    assert [column for column in result.columns if column.startswith('FlowTo')] == flow_to_columns
+    for column in ['Name_UA', *flow_to_columns]:
+        pd.testing.assert_series_equal(result[column].astype(object).where(result[column].notna(), None),
+                                       expected[column].astype(object).where(expected[column].notna(), None))
+    assert result.geometry.geom_equals_exact(expected.geometry, tolerance=0).all()
@@ -0,0 +1,30 @@
+import os
+
+import pandas as pd
+
+from naming_subb import PipelineConfig, read_layer, run_batch, run_pipeline
+
+
+def test_batch_matches_standalone_runs(synthetic_regions, tmp_path):
+    # Спільний кеш перетинів, як у пакетному запуску з параметрами за замовчуванням;
+    # один потік, щоб друга область гарантовано читала кеш після першої
+    layers = synthetic_regions['west']
+    config = PipelineConfig(rivers_path=layers['rivers_path'], rivers_new_path=layers['rivers_new_path'],
+                            riv1_path=layers['riv1_path'], output_dir=str(tmp_path / 'batch'),
+                            state_dir=str(tmp_path / 'batch_state'),
+                            builder_options={'cache_dir': str(tmp_path / 'intersections_cache')})
+    subbasins_paths = [synthetic_regions[region]['subbasins_path'] for region in ('west', 'east')]
+    results = run_batch(config, subbasins_paths, threads=1)
+    assert not [result for result in results.values() if isinstance(result, Exception)]
+
+    for subbasins_path in subbasins_paths:
+        name = os.path.splitext(os.path.basename(subbasins_path))[0]
+        standalone_path = str(tmp_path / 'standalone' / f'{name}.geojson')
+        run_pipeline(config.replace(subbasins_path=subbasins_path, output_path=standalone_path,
+                                    state_dir=str(tmp_path / 'standalone_state' / name),
+                                    builder_options={'cache_dir': None}))
+        batch = read_layer(os.path.join(config.output_dir, f'{name}.geojson'))
+        standalone = read_layer(standalone_path)
+        assert batch['Name_UA'].notna().any()
+        pd.testing.assert_frame_equal(batch.drop(columns='geometry'), standalone.drop(columns='geometry'))
+        assert batch.geometry.geom_equals_exact(standalone.geometry, tolerance=0).all()
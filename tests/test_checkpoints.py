@@ -0,0 +1,25 @@
+import pandas as pd
+
+from naming_subb import GeoDataManager, SubbasinBuilder
+
+
+def test_resume_after_partial_run_uses_buffered_riv1(synthetic_regions, tmp_path):
+    paths = synthetic_regions['west']
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    stop_after = 'compare_and_update_river_names'
+
+    full = SubbasinBuilder(**paths, cache_dir=None)
+    GeoDataManager(full).construct(stop_after=stop_after)
+
+    # Контрольна точка після буферизації riv1, записана запуском, що на ній зупинився
+    GeoDataManager(SubbasinBuilder(**paths, cache_dir=None), checkpoint_dir=checkpoint_dir).construct(
+        stop_after='geometry_buffer_riv1')
+    resumed = SubbasinBuilder(**paths, cache_dir=None)
+    GeoDataManager(resumed, checkpoint_dir=checkpoint_dir).construct(start_at='analyze_river_intersections',
+                                                                      stop_after=stop_after)
+
+    # Аналіз перетинів після відновлення бачить той самий буферизований і перепроєктований riv1
+    assert resumed.riv1.crs == full.riv1.crs
+    assert resumed.riv1.geometry.geom_equals_exact(full.riv1.geometry, tolerance=0).all()
+    assert resumed.max_intersections_dict == full.max_intersections_dict
+    pd.testing.assert_series_equal(resumed.subbasins['Name_UA'].astype(object), full.subbasins['Name_UA'].astype(object))
@@ -0,0 +1,77 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from naming_subb import SubbasinBuilder, simplify_shared_arcs
+
+
+def synthetic_coverage(side=20, cell_size=1000, points_per_edge=40, seed=0):
+    # Сітка полігонів зі звивистими межами; кожна межа будується один раз і спільна для обох сусідів,
+    # тож покриття не має перекриттів і щілин
+    rng = np.random.default_rng(seed)
+    steps = np.linspace(0, 1, points_per_edge + 2)[1:-1, None]
+
+    def edge(start, end):
+        points = start + (end - start) * steps
+        normal = np.array([start[1] - end[1], end[0] - start[0]]) / cell_size
+        return points + normal * rng.normal(0, 5, (points_per_edge, 1))
+
+    nodes = np.stack(np.meshgrid(np.arange(side + 1), np.arange(side + 1), indexing='ij'), axis=-1) * float(cell_size)
+    horizontal = {(i, j): edge(nodes[i, j], nodes[i + 1, j]) for i in range(side) for j in range(side + 1)}
+    vertical = {(i, j): edge(nodes[i, j], nodes[i, j + 1]) for i in range(side + 1) for j in range(side)}
+    polygons = []
+    for i in range(side):
+        for j in range(side):
+            ring = np.concatenate([[nodes[i, j]], horizontal[i, j], [nodes[i + 1, j]], vertical[i + 1, j],
+                                   [nodes[i + 1, j + 1]], horizontal[i, j + 1][::-1], [nodes[i, j + 1]],
+                                   vertical[i, j][::-1], [nodes[i, j]]])
+            polygons.append(shapely.Polygon(ring))
+    return np.array(polygons, dtype=object)
+
+
+def test_shared_arcs_keep_coverage_without_gaps_or_overlaps():
+    polygons = synthetic_coverage()
+    assert shapely.coverage_is_valid(polygons) and shapely.is_valid(polygons).all()
+    simplified = simplify_shared_arcs(polygons, 20)
+    union = shapely.union_all(simplified)
+    assert shapely.get_num_coordinates(simplified).sum() < shapely.get_num_coordinates(polygons).sum()
+    # Без щілин (об'єднання - один полігон без дірок) і без перекриттів
+    assert union.geom_type == 'Polygon' and shapely.get_num_interior_rings(union) == 0
+    assert abs(shapely.area(simplified).sum() - union.area) < 1
+
+
+def test_overlapping_input_is_not_made_larger():
+    # Зсунуті копії перекриваються; вузлування не повинно давати більше вершин, ніж незалежне спрощення
+    polygons = synthetic_coverage()
+    polygons = np.concatenate([polygons, shapely.transform(polygons, lambda coords: coords + 1234.5)])
+    simplified = simplify_shared_arcs(polygons, 20)
+    independent = shapely.simplify(polygons, 20, preserve_topology=True)
+    assert shapely.get_num_coordinates(simplified).sum() <= shapely.get_num_coordinates(independent).sum()
+    assert shapely.is_valid(simplified).all()
+
+
+def test_overlaps_are_left_to_lower_subbasin(tmp_path):
+    # Суббасейн 2 стоїть першим, але спільна ділянка має залишитися за суббасейном 1;
+    # суббасейн 3 лише торкається суббасейну 2 межею і не змінюється
+    subbasins = gpd.GeoDataFrame(
+        {'Subbasin': [2, 1, 3]},
+        geometry=[shapely.box(5, 0, 15, 10), shapely.box(0, 0, 10, 10), shapely.box(15, 0, 25, 10)],
+        crs='EPSG:32636')
+    path = str(tmp_path / 'subbasins.geojson')
+    subbasins.to_file(path, driver='GeoJSON')
+    builder = SubbasinBuilder(subbasins_path=path, cache_dir=None)
+    builder.remove_and_merge_intersections()
+
+    geometries = builder.subbasins.set_index('Subbasin').geometry
+    polygons = np.asarray(geometries.values, dtype=object)
+    overlaps = shapely.intersection(polygons[:, None], polygons[None, :])
+    np.fill_diagonal(overlaps, None)
+    assert np.nan_to_num(shapely.area(overlaps)).max() < 1e-9
+    assert geometries[1].equals(shapely.box(0, 0, 10, 10))
+    assert geometries[2].equals(shapely.box(10, 0, 15, 10))
+    assert geometries[3].equals(shapely.box(15, 0, 25, 10))
+
+    report = builder.overlap_report
+    assert report['Subbasin'].tolist() == [2]
+    assert report['overlaps_with'].tolist() == [[1]]
+    assert abs(report['removed_area'].iloc[0] - 50) < 1e-9
@@ -0,0 +1,20 @@
+from naming_subb import GeoDataManager, SubbasinBuilder
+
+
+def test_hierarchy_is_not_cut_at_subbasin_extent(synthetic_regions):
+    paths = synthetic_regions['west']
+    clipped = SubbasinBuilder(**paths, cache_dir=None)
+    unclipped = SubbasinBuilder(**paths, cache_dir=None, clip_to_subbasins=False)
+    assert len(clipped.rivers) < len(unclipped.rivers)
+    assert dict(clipped.hierarchy.items()) == dict(unclipped.hierarchy.items())
+
+
+def test_river_names_intern_only_names_in_use(synthetic_regions):
+    builder = SubbasinBuilder(**synthetic_regions['west'], cache_dir=None)
+    GeoDataManager(builder).construct(stop_after='update_subbasins_with_main_river')
+    interned = len(builder.names)
+    builder.compare_and_update_river_names()
+    # У таблицю додаються лише назви з префіксом для річок, що є в колонці MainRiver
+    added = set(builder.names.names[interned:])
+    assert added
+    assert added <= set(builder.subbasins['Name_UA'].dropna())
@@ -0,0 +1,54 @@
+import pandas as pd
+import shapely
+
+from naming_subb import PipelineConfig, read_layer
+
+
+def test_output_path_change_keeps_incremental_mode(synthetic_regions, tmp_path):
+    layers = synthetic_regions['west']
+    config = PipelineConfig(**layers, output_path=str(tmp_path / 'first.geojson'),
+                            state_dir=str(tmp_path / 'run_state'), builder_options={'cache_dir': None})
+    config.create_manager().construct()
+
+    moved = config.replace(output_path=str(tmp_path / 'moved' / 'second.geojson'))
+    manager = moved.create_manager()
+    assert manager.builder.update_incrementally(moved.state_dir, manager.stages)
+
+
+def test_incremental_run_matches_full_run(synthetic_regions, tmp_path):
+    # Копії шарів, які змінюються між запусками
+    layers = {}
+    for key, path in synthetic_regions['west'].items():
+        layers[key] = str(tmp_path / f'{key}.geojson')
+        read_layer(path).to_file(layers[key], encoding='UTF-8')
+    config = PipelineConfig(**layers, output_path=str(tmp_path / 'first.geojson'),
+                            state_dir=str(tmp_path / 'run_state'), builder_options={'cache_dir': None})
+    config.create_manager().construct()
+    first = read_layer(config.output_path)
+
+    # Змінені межі одного суббасейну і нова назва річки, що дає назву суббасейнам
+    subbasins = read_layer(layers['subbasins_path'])
+    subbasins.loc[0, 'geometry'] = shapely.affinity.scale(subbasins.geometry.iloc[0], 0.8, 0.8)
+    subbasins.to_file(layers['subbasins_path'], encoding='UTF-8')
+    rivers = read_layer(layers['rivers_path'])
+    renamed = first['Name_UA'].value_counts().index[0].removeprefix('р. ')
+    assert (rivers['name_ua'] == renamed).any()
+    rivers.loc[rivers['name_ua'] == renamed, 'name_ua'] = renamed + ' Нова'
+    rivers.to_file(layers['rivers_path'], encoding='UTF-8')
+
+    incremental = config.replace(output_path=str(tmp_path / 'incremental.geojson'))
+    report = incremental.create_manager().construct_incremental()
+    # Результат оновлено без повторного запуску конвеєра
+    assert [record['stage'] for record in report['stages']][0] == 'update_incrementally'
+    full = config.replace(output_path=str(tmp_path / 'full.geojson'), state_dir=None)
+    full.create_manager().construct()
+
+    updated = read_layer(incremental.output_path)
+    expected = read_layer(full.output_path)
+    assert not updated['Name_UA'].eq(f'р. {renamed}').any()
+    assert updated['Name_UA'].eq(f'р. {renamed} Нова').any()
+    reshaped = subbasins.loc[0, 'Subbasin']
+    assert not updated.loc[updated['Subbasin'] == reshaped].geometry.iloc[0].equals(
+        first.loc[first['Subbasin'] == reshaped].geometry.iloc[0])
+    pd.testing.assert_frame_equal(updated.drop(columns='geometry'), expected.drop(columns='geometry'))
+    assert updated.geometry.geom_equals_exact(expected.geometry, tolerance=0).all()
@@ -0,0 +1,16 @@
+import os
+
+import pandas as pd
+
+from conftest import name_subbasins
+
+
+def test_cache_is_keyed_by_subbasin_extent(synthetic_regions, tmp_path):
+    cache_dir = str(tmp_path / 'intersections_cache')
+    for region in ('west', 'east'):
+        cached = name_subbasins(synthetic_regions[region], cache_dir=cache_dir)
+        uncached = name_subbasins(synthetic_regions[region], cache_dir=None)
+        assert cached['Name_UA'].notna().any()
+        pd.testing.assert_series_equal(cached['Name_UA'].astype(object), uncached['Name_UA'].astype(object))
+    # Кожне охоплення має власний запис у спільному кеші
+    assert len(os.listdir(cache_dir)) == 2
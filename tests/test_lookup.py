@@ -0,0 +1,65 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+import shapely
+
+from naming_subb import OUTPUT_CRS
+from subbasin_lookup import SubbasinIndex, make_server
+
+
+@pytest.fixture
+def index():
+    # Два суміжні квадрати зі спільною межею x = 10
+    subbasins = gpd.GeoDataFrame({
+        'Subbasin': [1, 2],
+        'Name_UA': ['річка Рось', 'річка Тясмин'],
+        'Fragment': [0, 0],
+        'FlowTo': ['річка Дніпро', 'річка Дніпро'],
+        'FlowTo2': ['Чорне море', None],
+    }, geometry=[shapely.box(0, 0, 10, 10), shapely.box(10, 0, 20, 10)], crs=OUTPUT_CRS)
+    return SubbasinIndex(subbasins)
+
+
+def test_lookup_points(index):
+    result = index.lookup_points([5, 15, 50], [5, 5, 5])
+    assert list(result.columns) == ['Subbasin', 'Name_UA', 'Fragment', 'FlowTo', 'FlowTo2']
+    assert result['Subbasin'].tolist()[:2] == [1, 2]
+    assert result.loc[1, 'Name_UA'] == 'річка Тясмин'
+    # Промах - рядок з NA
+    assert result.loc[2].isna().all()
+    assert str(result['Subbasin'].dtype) == 'Int64'
+
+
+def test_lookup_line(index):
+    result = index.lookup([shapely.LineString([(5, 5), (15, 5)]), shapely.Point(50, 50)])
+    assert result['query'].tolist() == [0, 0]
+    assert result['Subbasin'].tolist() == [1, 2]
+
+
+def test_save_load_round_trip(index, tmp_path):
+    index.save(str(tmp_path / 'index'))
+    loaded = SubbasinIndex.load(str(tmp_path / 'index'))
+    assert len(loaded) == len(index)
+    pd.testing.assert_frame_equal(loaded.attributes, index.attributes)
+    assert shapely.equals(loaded.geometries, index.geometries).all()
+    pd.testing.assert_frame_equal(loaded.lookup_points([5, 15], [5, 5]), index.lookup_points([5, 15], [5, 5]))
+
+
+def test_post_rejects_non_object_body(index):
+    server = make_server(index, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f'http://{server.server_address[0]}:{server.server_address[1]}/lookup'
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(urllib.request.Request(url, data=b'[1, 2]', method='POST'))
+        assert error.value.code == 400
+        assert 'error' in json.loads(error.value.read())
+    finally:
+        server.shutdown()
+        server.server_close()
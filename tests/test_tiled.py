@@ -0,0 +1,29 @@
+import sqlite3
+
+import pytest
+
+from naming_subb import SubbasinBuilder, pyogrio, read_layer
+
+
+def intersections(paths, **builder_options):
+    builder = SubbasinBuilder(**paths, cache_dir=None, **builder_options)
+    builder.check_and_change_crs()
+    builder.initialize_and_set_column_types()
+    builder.geometry_buffer_riv1(buffer_size=25)
+    builder.analyze_river_intersections()
+    return builder.max_intersections_dict
+
+
+@pytest.mark.skipif(pyogrio is None, reason="pyogrio is required for tiled processing")
+def test_tiled_mode_handles_gpkg_fids(synthetic_regions, tmp_path):
+    # GPKG: fid з 1 і з пропусками після видалення об'єктів
+    paths = dict(synthetic_regions['west'])
+    riv1_path = str(tmp_path / 'riv1.gpkg')
+    read_layer(paths['riv1_path']).to_file(riv1_path, driver='GPKG', layer='riv1')
+    with sqlite3.connect(riv1_path) as connection:
+        connection.execute("DELETE FROM riv1 WHERE fid % 7 = 0")
+    paths['riv1_path'] = riv1_path
+
+    tiled = intersections(paths, tile_size=20000)
+    assert tiled
+    assert tiled == intersections(paths)